@@ -0,0 +1,243 @@
+"""Local stand-in for the NASA archives hydrafloods.fetch downloads from.
+
+Serves LP DAAC style date directory listings for VIIRS and MODIS, the LANCE
+NRT "Recent" directories and the GES DISC ATMS day directories with granule
+metadata xml files. Granules are synthetic bytes generated on the fly so no
+disk space is needed. Range, ETag/If-None-Match and If-Modified-Since are
+supported so the resumable download and conditional listing paths are
+exercised as they would be against the real servers.
+"""
+from __future__ import print_function
+import re
+import hashlib
+import datetime
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BLOCK = hashlib.sha256(b'hydrafloods').digest() * 2048  # 64KB repeated to fill granules
+MODIFIED = formatdate(0,usegmt=True)
+
+VIIRS_DIR = re.compile(r'^/DP102/VIIRS/(\w+)\.001/(\d{4})\.(\d{2})\.(\d{2})/$')
+MODIS_DIR = re.compile(r'^/(MOLT|MOLA)/(\w+)\.006/(\d{4})\.(\d{2})\.(\d{2})/$')
+VIIRS_NRT_DIR = re.compile(r'^/api/v2/content/archives/allData/5000/(\w+)/Recent/$')
+MODIS_NRT_DIR = re.compile(r'^/api/v2/content/archives/allData/6/(\w+)/Recent/$')
+ATMS_DIR = re.compile(r'^/data/SNPP_Sounder_Level1/SNPPATMSL1B\.2/(\d{4})/(\d{3})/$')
+
+ATMS_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<S4PAGranuleMetaDataFile>
+  <DataGranule><GranuleID>{granule}</GranuleID></DataGranule>
+  <SpatialDomainContainer><HorizontalSpatialDomainContainer><GPolygon><Boundary>
+{points}
+  </Boundary></GPolygon></HorizontalSpatialDomainContainer></SpatialDomainContainer>
+</S4PAGranuleMetaDataFile>
+'''
+ATMS_POINT = '    <Point><PointLongitude>{0}</PointLongitude><PointLatitude>{1}</PointLatitude></Point>'
+
+
+def _listing(names):
+    links = '\n'.join('<a href="{0}">{0}</a>'.format(n) for n in names)
+    return '<html><body><pre>\n<a href="/">Parent Directory</a>\n{0}\n</pre></body></html>'.format(links).encode()
+
+
+def _doy(year,month,day):
+    date = datetime.datetime(int(year),int(month),int(day))
+    return (date - datetime.datetime(date.year,1,1)).days + 1
+
+
+class StandInArchive(object):
+    """Threaded http server mimicking the archive layouts used by fetch
+
+    Args:
+        tiles (list, optional): (h,v) tiles present in every VIIRS/MODIS directory
+        default = 12 tiles around h27v07
+        fileSize (int, optional): size in bytes of every synthetic granule
+        default = 8 MB
+        nSwaths (int, optional): number of ATMS granules per day
+        default = 240
+    """
+    def __init__(self,tiles=None,fileSize=8*1024*1024,nSwaths=240):
+        if tiles is None:
+            tiles = [(h,v) for h in range(25,29) for v in range(6,9)]
+        self.tiles = tiles
+        self.fileSize = fileSize
+        self.nSwaths = nSwaths
+        self.requests = 0
+
+        self._lock = threading.Lock()
+        self._server = None
+
+        return
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self._server.server_port)
+
+    def start(self):
+        archive = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with archive._lock:
+                    archive.requests += 1
+                archive._serve(self)
+
+            def log_message(self,*args):
+                return
+
+        self._server = ThreadingHTTPServer(('127.0.0.1',0),Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever,daemon=True).start()
+
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        return
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,*args):
+        self.stop()
+        return
+
+    def patch(self,fetch):
+        """Points the archive urls of the fetch module at this server"""
+        fetch.VIIRS_ARCHIVE = self.url + '/DP102/VIIRS/{0}.001/{1}.{2:02d}.{3:02d}/'
+        fetch.VIIRS_NRT = self.url + '/api/v2/content/archives/allData/5000/{0}/Recent/'
+        fetch.MODIS_ARCHIVE = self.url + '/{0}/{1}.006/{2}.{3:02d}.{4:02d}/'
+        fetch.MODIS_NRT = self.url + '/api/v2/content/archives/allData/6/{0}/Recent/'
+        fetch.ATMS_ARCHIVE = self.url + '/data/SNPP_Sounder_Level1/SNPPATMSL1B.2/{0}/{1:03d}/'
+        return
+
+    def _swaths(self,year,doy):
+        # ascending swaths stepping west around the globe, 6 minute granules
+        swaths = []
+        for i in range(self.nSwaths):
+            t = datetime.datetime(int(year),1,1) + datetime.timedelta(days=int(doy)-1,minutes=6*i)
+            name = 'SNDR.SNPP.ATMS.{0}.m06.g{1:03d}.L1B.std.v02_05.G.nc'.format(t.strftime('%Y%m%dT%H%M'),i+1)
+            lon0 = 180 - (i*25.0) % 360
+            lat0 = -60 + (i*20) % 120
+            verts = [(lon0-20,lat0),(lon0+20,lat0),(lon0+20,lat0+20),(lon0-20,lat0+20)]
+            verts = [(((x+180) % 360) - 180,y) for x,y in verts]
+            swaths.append((name,verts))
+
+        return swaths
+
+    def _names(self,path):
+        m = VIIRS_DIR.match(path)
+        if m:
+            product,y,mo,d = m.groups()
+            names = ['{0}.A{1}{2:03d}.h{3:02d}v{4:02d}.001.2019100000000.h5'.format(product,y,_doy(y,mo,d),h,v)
+                     for h,v in self.tiles]
+            return names + [n + '.xml' for n in names]
+
+        m = MODIS_DIR.match(path)
+        if m:
+            _,product,y,mo,d = m.groups()
+            names = ['{0}.A{1}{2:03d}.h{3:02d}v{4:02d}.006.2019100000000.hdf'.format(product,y,_doy(y,mo,d),h,v)
+                     for h,v in self.tiles]
+            return names + [n + '.xml' for n in names]
+
+        m = VIIRS_NRT_DIR.match(path) or MODIS_NRT_DIR.match(path)
+        if m:
+            today = datetime.datetime.now()
+            suffix = '.001.h5' if VIIRS_NRT_DIR.match(path) else '.006.NRT.hdf'
+            return ['{0}.A{1}{2:03d}.h{3:02d}v{4:02d}{5}'.format(m.group(1),(today-datetime.timedelta(i)).year,
+                        (today-datetime.timedelta(i)).timetuple().tm_yday,h,v,suffix)
+                    for i in range(8) for h,v in self.tiles]
+
+        m = ATMS_DIR.match(path)
+        if m:
+            names = [name for name,_ in self._swaths(*m.groups())]
+            return names + [n + '.xml' for n in names]
+
+        return None
+
+    def _serve(self,req):
+        path = req.path.split('?')[0]
+
+        if path.endswith('/'):
+            names = self._names(path)
+            if names is None:
+                return self._send(req,404,b'')
+            return self._send(req,200,_listing(names),'text/html')
+
+        directory,name = path.rsplit('/',1)
+        names = self._names(directory + '/')
+        if (names is None) or (name not in names):
+            return self._send(req,404,b'')
+
+        if name.endswith('.nc.xml'):
+            m = ATMS_DIR.match(directory + '/')
+            verts = dict(self._swaths(*m.groups()))[name[:-4]]
+            points = '\n'.join(ATMS_POINT.format(x,y) for x,y in verts)
+            body = ATMS_XML.format(granule=name[:-4],points=points).encode()
+            return self._send(req,200,body,'text/xml')
+
+        return self._sendGranule(req)
+
+    def _send(self,req,status,body,contentType='application/octet-stream'):
+        etag = '"{0}"'.format(hashlib.md5(body).hexdigest())
+        if (status == 200) and (req.headers.get('If-None-Match') == etag):
+            status,body = 304,b''
+
+        req.send_response(status)
+        req.send_header('Content-Type',contentType)
+        req.send_header('Content-Length',str(len(body)))
+        req.send_header('ETag',etag)
+        req.send_header('Last-Modified',MODIFIED)
+        req.end_headers()
+        req.wfile.write(body)
+
+        return
+
+    def _sendGranule(self,req):
+        size = self.fileSize
+        start = 0
+
+        end = size
+        rng = req.headers.get('Range')
+        if rng:
+            first,last = rng.split('=')[1].split('-')
+            start = int(first)
+            end = min(int(last)+1,size) if last else size
+            if start >= size:
+                req.send_response(416)
+                req.send_header('Content-Range','bytes */{0}'.format(size))
+                req.send_header('Content-Length','0')
+                req.end_headers()
+                return
+            req.send_response(206)
+            req.send_header('Content-Range','bytes {0}-{1}/{2}'.format(start,end-1,size))
+        else:
+            req.send_response(200)
+
+        req.send_header('Content-Type','application/octet-stream')
+        req.send_header('Content-Length',str(end-start))
+        req.send_header('Accept-Ranges','bytes')
+        req.end_headers()
+
+        pos = start
+        while pos < end:
+            offset = pos % len(BLOCK)
+            chunk = BLOCK[offset:offset + min(len(BLOCK)-offset,end-pos)]
+            req.wfile.write(chunk)
+            pos += len(chunk)
+
+        return
+
+
+if __name__ == '__main__':
+    import time
+    with StandInArchive() as archive:
+        print('serving stand-in archive at {0}'.format(archive.url))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
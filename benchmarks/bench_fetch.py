@@ -0,0 +1,133 @@
+"""Throughput benchmark for hydrafloods.fetch against the local stand-in archive.
+
+Every case runs in a fresh process so the reported peak resident memory
+belongs to that case alone. Usage:
+
+    python benchmarks/bench_fetch.py --size 32 --workers 8
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import argparse
+import datetime
+import resource
+import tempfile
+import multiprocessing
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import StandInArchive
+
+DATE = datetime.datetime(2019,1,1)
+
+
+def _region():
+    from shapely.geometry import box
+    return box(91,9,102,29)
+
+
+def _viirs(fetch,archive,outdir,creds,workers):
+    return [fetch.viirs(DATE,h,v,outdir=outdir,creds=creds,product='VNP09GA') for h,v in archive.tiles]
+
+
+def _viirsMany(fetch,archive,outdir,creds,workers):
+    return fetch.viirs_many(DATE,archive.tiles,outdir=outdir,creds=creds,product='VNP09GA',workers=workers)
+
+
+def _modis(fetch,archive,outdir,creds,workers):
+    return [fetch.modis(DATE,h,v,outdir=outdir,creds=creds,product='MOD09GA') for h,v in archive.tiles]
+
+
+def _modisMany(fetch,archive,outdir,creds,workers):
+    return fetch.modis_many(DATE,archive.tiles,outdir=outdir,creds=creds,product='MOD09GA',workers=workers)
+
+
+def _atms(fetch,archive,outdir,creds,workers):
+    return fetch.atms(DATE,_region(),outdir=outdir,creds=creds,workers=workers)
+
+
+def _swathFilter(fetch,archive,outdir,creds,workers):
+    # cold cache, metadata for every granule of the day is requested
+    url = fetch.ATMS_ARCHIVE.format(DATE.year,1)
+    with fetch._session(creds,workers) as s:
+        xmls = [url + x for x in fetch._index().files(s,url,'.xml')]
+        fetch.swathFilter(_region(),xmls,s=s,workers=workers)
+
+    # metadata files are parsed in memory, report them as files without bytes
+    return xmls
+
+
+CASES = {
+    'viirs':_viirs,
+    'viirs_many':_viirsMany,
+    'modis':_modis,
+    'modis_many':_modisMany,
+    'atms':_atms,
+    'swathFilter':_swathFilter,
+}
+
+
+def _run(case,archive,workdir,creds,workers,queue):
+    os.environ['HYDRAFLOODS_CACHE'] = os.path.join(workdir,'cache')
+    from hydrafloods import fetch
+    archive.patch(fetch)
+
+    outdir = os.path.join(workdir,case)
+    os.makedirs(outdir)
+
+    t0 = time.time()
+    files = [f for f in CASES[case](fetch,archive,outdir,creds,workers) if f]
+    elapsed = time.time() - t0
+
+    nbytes = sum(os.path.getsize(f) for f in files if os.path.exists(f))
+    # ru_maxrss is reported in kilobytes on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+    queue.put((case,len(files),nbytes,elapsed,peak))
+
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size',type=float,default=8,help='size of each synthetic granule in MB')
+    parser.add_argument('--workers',type=int,default=4,help='workers for the concurrent fetch calls')
+    parser.add_argument('--swaths',type=int,default=240,help='number of ATMS granules per day')
+    parser.add_argument('--cases',nargs='+',default=sorted(CASES.keys()),choices=sorted(CASES.keys()))
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='hf_bench_')
+    creds = os.path.join(workdir,'bench.netrc')
+    with open(creds,'w') as f:
+        f.write('machine https://urs.earthdata.nasa.gov\nlogin bench\npassword bench\n')
+
+    ctx = multiprocessing.get_context('fork')
+    archive = StandInArchive(fileSize=int(args.size*1024*1024),nSwaths=args.swaths)
+
+    rows = []
+    try:
+        with archive:
+            for case in args.cases:
+                queue = ctx.Queue()
+                p = ctx.Process(target=_run,args=(case,archive,os.path.join(workdir,case+'_run'),creds,args.workers,queue))
+                p.start()
+                p.join()
+                if p.exitcode != 0:
+                    print('{0} failed with exit code {1}'.format(case,p.exitcode))
+                    continue
+                rows.append(queue.get())
+    finally:
+        shutil.rmtree(workdir)
+
+    print('{0:<12} {1:>6} {2:>9} {3:>9} {4:>9} {5:>12}'.format('case','files','seconds','files/s','MB/s','peak RSS MB'))
+    for case,n,nbytes,elapsed,peak in rows:
+        print('{0:<12} {1:>6d} {2:>9.2f} {3:>9.2f} {4:>9.1f} {5:>12.1f}'.format(
+            case,n,elapsed,n/elapsed,nbytes/1024./1024./elapsed,peak))
+
+    return
+
+
+if __name__ == '__main__':
+    main()
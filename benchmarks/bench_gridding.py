@@ -0,0 +1,120 @@
+"""Speed and accuracy of the ATMS gridding engines of hydrafloods.preprocess.
+
+A synthetic ATMS swath (96 beams per scan, cross-track scan to +/-52.7 deg)
+samples a smooth land fraction field, which is gridded onto the 16 km mercator
+grid used by preprocess.atms with each engine. Accuracy is reported against the
+field at the grid cell centers and against the bilinear result. Usage:
+
+    python benchmarks/bench_gridding.py --radius 50000 --repeat 3
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from pyproj import Transformer
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hydrafloods import preprocess
+
+RES = 16000
+
+
+def _field(lon,lat):
+    # land fraction with broad structure and a narrow low band like a flooded valley
+    f = 0.5 + 0.4 * np.sin(np.radians(lon) * 40) * np.cos(np.radians(lat) * 30)
+    f -= 0.5 * np.exp(-((lon - 96.) / 0.3)**2)
+    return np.clip(f,0,1)
+
+
+def _swath(nScans,lon0=96.,lat0=10.):
+    # flat earth approximation of the ATMS scan geometry, 824 km orbit and ~16.6 km along track spacing
+    angles = np.linspace(-52.7,52.7,96)
+    cross = 824. * np.tan(np.radians(angles))
+    along = np.arange(nScans) * 16.6
+
+    dx,dy = np.meshgrid(cross,along)
+    lats = lat0 + dy / 111.32
+    lons = lon0 + dx / (111.32 * np.cos(np.radians(lats)))
+    satZen = np.broadcast_to(np.abs(angles),lons.shape)
+
+    return lons,lats,satZen
+
+
+def _grid(lons,lats):
+    toMerc = Transformer.from_crs(4326,3857,always_xy=True)
+    xx,yy = toMerc.transform(lons,lats)
+
+    eastings,northings = preprocess._mercatorGrid(RES)
+    ee = eastings[np.where((eastings>xx.min()) & (eastings<xx.max()))]
+    nn = northings[np.where((northings>yy.min()) & (northings<yy.max()))]
+
+    gt = (ee.min(),RES,0,nn.max(),0,-RES)
+    return xx,yy,ee,nn,gt
+
+
+def _time(func,repeat):
+    best,result = np.inf,None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best,time.perf_counter()-t0)
+
+    return best,result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scans',type=int,default=135,help='scans per granule, 135 is one 6 minute granule')
+    parser.add_argument('--radius',type=float,default=50000,help='gridding radius in meters')
+    parser.add_argument('--nprocs',type=int,default=1,help='processes of the bilinear neighbour search')
+    parser.add_argument('--repeat',type=int,default=3)
+    args = parser.parse_args()
+
+    lons,lats,satZen = _swath(args.scans)
+    data = np.where(satZen<50,_field(lons,lats),np.nan)
+    xx,yy,ee,nn,gt = _grid(lons,lats)
+    shape = (nn.size,ee.size)
+
+    toGeo = Transformer.from_crs(3857,4326,always_xy=True)
+    cx,cy = np.meshgrid(ee + RES/2.,nn[::-1] - RES/2.)
+    truth = _field(*toGeo.transform(cx,cy))
+
+    def _bilinear():
+        # neighbour info cache disabled so every run pays for the search
+        preprocess._bilinearCache.clear()
+        area = preprocess.mercatorArea(ee.min(),nn.min(),ee.max(),nn.max(),ee.size,nn.size)
+        info = preprocess.bilinearInfo(lons,lats,area,args.radius,epsilon=0.1,
+                                       nprocs=args.nprocs,cachedir=False)
+        return preprocess.bilinearResample(data,info,area.shape)
+
+    cases = [
+        ('bilinear',_bilinear),
+        ('bucket',lambda: preprocess.bucketGrid(data,xx,yy,gt,shape)),
+        ('gaussian',lambda: preprocess.bucketGrid(data,xx,yy,gt,shape,radius=args.radius)),
+    ]
+
+    rows = []
+    for name,func in cases:
+        elapsed,result = _time(func,args.repeat)
+        rows.append((name,elapsed,result))
+
+    reference = rows[0][2]
+    print('swath {0}x{1} samples, grid {2}x{3} cells'.format(args.scans,96,shape[0],shape[1]))
+    print('{0:<10} {1:>9} {2:>8} {3:>9} {4:>12} {5:>14}'.format(
+        'method','seconds','speedup','coverage','RMSE truth','RMSE bilinear'))
+    for name,elapsed,result in rows:
+        valid = np.isfinite(result)
+        common = valid & np.isfinite(reference)
+        rmseTruth = np.sqrt(np.nanmean((result[valid] - truth[valid])**2))
+        rmseRef = np.sqrt(np.mean((result[common] - reference[common])**2))
+        print('{0:<10} {1:>9.4f} {2:>7.1f}x {3:>8.1%} {4:>12.4f} {5:>14.4f}'.format(
+            name,elapsed,rows[0][1]/elapsed,valid.mean(),rmseTruth,rmseRef))
+
+    return
+
+
+if __name__ == '__main__':
+    main()
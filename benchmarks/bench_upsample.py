@@ -0,0 +1,53 @@
+"""Benchmark of utils.upsample against ndimage.zoom(order=0) for the 2x
+nearest neighbour upsampling of full VIIRS tiles. Usage:
+
+    python benchmarks/bench_upsample.py --repeat 5
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from scipy import ndimage
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hydrafloods import utils
+
+
+def _time(func,repeat):
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best,time.perf_counter()-t0)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat',type=int,default=5,help='number of timed runs, the best is reported')
+    args = parser.parse_args()
+
+    # 1km qa/M band grid of a tile upsampled to 500m, and a full 500m tile to 250m
+    cases = [('int16 1200->2400',np.random.randint(-100,16000,(1200,1200)).astype(np.int16)),
+             ('uint8 1200->2400',np.random.randint(0,255,(1200,1200)).astype(np.uint8)),
+             ('float64 2400->4800',np.random.random((2400,2400)))]
+
+    print('{0:<20} {1:>12} {2:>12} {3:>12} {4:>9}'.format('case','zoom s','upsample s','prealloc s','speedup'))
+    for name,data in cases:
+        out = np.empty((data.shape[0]*2,data.shape[1]*2),dtype=data.dtype)
+
+        zoom = _time(lambda: ndimage.zoom(data,2,order=0),args.repeat)
+        upsample = _time(lambda: utils.upsample(data,2),args.repeat)
+        prealloc = _time(lambda: utils.upsample(data,2,out=out),args.repeat)
+
+        print('{0:<20} {1:>12.4f} {2:>12.4f} {3:>12.4f} {4:>8.1f}x'.format(name,zoom,upsample,prealloc,zoom/prealloc))
+
+    return
+
+
+if __name__ == '__main__':
+    main()
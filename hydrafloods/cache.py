@@ -0,0 +1,164 @@
+from __future__ import absolute_import
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+
+from . import utils
+
+
+class GranuleCache(object):
+    """Content-addressed store of downloaded granules shared between workdirs.
+    Granules are stored once under their checksum and recorded in a sqlite
+    manifest keyed by granule id, and are handed out to workdirs as read-only
+    hardlinks. When the store grows beyond maxBytes the least recently used
+    granules are evicted.
+
+    Args:
+        root (str, optional): directory of the store and manifest
+        default = utils.cache_dir('granules')
+        maxBytes (int, optional): size limit of the store in bytes
+        default = 50 GB
+    """
+    def __init__(self,root=None,maxBytes=50*1024**3):
+        if root is None:
+            root = utils.cache_dir('granules')
+        self.root = root
+        self.maxBytes = maxBytes
+
+        os.makedirs(os.path.join(self.root,'objects'),exist_ok=True)
+        self.manifest = os.path.join(self.root,'manifest.sqlite')
+
+        with self._connect() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS granules '
+                        '(granule TEXT PRIMARY KEY, checksum TEXT, size INTEGER, path TEXT, accessed REAL)')
+
+        return
+
+    def _connect(self):
+        return sqlite3.connect(self.manifest,timeout=60)
+
+    @staticmethod
+    def _checksum(path,chunkSize=1024*1024):
+        md5 = hashlib.md5()
+        with open(path,'rb') as f:
+            for chunk in iter(lambda: f.read(chunkSize), b''):
+                md5.update(chunk)
+
+        return md5.hexdigest()
+
+    def get(self,granule):
+        """Returns the read-only path of a granule in the store or None if it is not cached"""
+        con = self._connect()
+        try:
+            with con:
+                row = con.execute('SELECT path FROM granules WHERE granule = ?',(granule,)).fetchone()
+                if row is None:
+                    return None
+
+                path = os.path.join(self.root,row[0])
+                if os.path.exists(path) != True:
+                    con.execute('DELETE FROM granules WHERE granule = ?',(granule,))
+                    return None
+
+                con.execute('UPDATE granules SET accessed = ? WHERE granule = ?',(time.time(),granule))
+        finally:
+            con.close()
+
+        return path
+
+    def link(self,granule,dest):
+        """Makes a cached granule available at dest as a hardlink to the store,
+        falling back to a copy when dest is on another filesystem
+
+        Returns:
+            dest (str): dest if the granule is cached, None otherwise
+        """
+        path = self.get(granule)
+        if path is None:
+            return None
+
+        if os.path.exists(dest):
+            if os.path.samefile(path,dest):
+                return dest
+            os.remove(dest)
+
+        try:
+            os.link(path,dest)
+        except OSError:
+            shutil.copyfile(path,dest)
+
+        return dest
+
+    def add(self,granule,path):
+        """Moves a downloaded granule into the store and replaces path with a
+        read-only link to the stored copy
+
+        Returns:
+            path (str): the linked path
+        """
+        checksum = self._checksum(path)
+        _,ext = os.path.splitext(path)
+        relPath = os.path.join('objects',checksum[:2],checksum+ext)
+        stored = os.path.join(self.root,relPath)
+
+        if os.path.exists(stored):
+            # identical content already stored under another id
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(stored),exist_ok=True)
+            try:
+                os.replace(path,stored)
+            except OSError:
+                # store on another filesystem, copy through a temporary file
+                shutil.copyfile(path,stored+'.part')
+                os.replace(stored+'.part',stored)
+                os.remove(path)
+            os.chmod(stored,0o444)
+
+        con = self._connect()
+        try:
+            with con:
+                con.execute('INSERT OR REPLACE INTO granules VALUES (?,?,?,?,?)',
+                            (granule,checksum,os.path.getsize(stored),relPath,time.time()))
+        finally:
+            con.close()
+
+        path = self.link(granule,path)
+        self.evict()
+
+        return path
+
+    def evict(self):
+        """Removes least recently used granules until the store is under maxBytes"""
+        con = self._connect()
+        try:
+            with con:
+                rows = con.execute('SELECT granule, checksum, size, path FROM granules ORDER BY accessed DESC').fetchall()
+
+                objects = {}
+                for granule,checksum,size,path in rows:
+                    objects.setdefault(path,size)
+                total = sum(objects.values())
+
+                # drop ids from the least recently used end until under the limit,
+                # an object is deleted once no remaining id references it
+                refs = {}
+                for granule,checksum,size,path in rows:
+                    refs[path] = refs.get(path,0) + 1
+
+                for granule,checksum,size,path in reversed(rows):
+                    if total <= self.maxBytes:
+                        break
+                    con.execute('DELETE FROM granules WHERE granule = ?',(granule,))
+                    refs[path] -= 1
+                    if refs[path] == 0:
+                        stored = os.path.join(self.root,path)
+                        if os.path.exists(stored):
+                            os.remove(stored)
+                        total -= size
+        finally:
+            con.close()
+
+        return
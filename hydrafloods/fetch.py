@@ -1,105 +1,228 @@
 import os
 import netrc
+import hashlib
 import requests
 import datetime
 import xmltodict
 import numpy as np
-import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Polygon
+from concurrent import futures
+from requests.adapters import HTTPAdapter
+from functools import lru_cache
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+from shapely.geometry import Polygon, box
+from shapely.ops import transform as reproject
+from pyproj import Transformer
+from collections import namedtuple
+
+from . import listing
+
+VIIRS_ARCHIVE = 'https://e4ftl01.cr.usgs.gov/DP102/VIIRS/{0}.001/{1}.{2:02d}.{3:02d}/'
+VIIRS_NRT = 'https://nrt3.modaps.eosdis.nasa.gov/api/v2/content/archives/allData/5000/{0}/Recent/'
+MODIS_ARCHIVE = 'https://e4ftl01.cr.usgs.gov/{0}/{1}.006/{2}.{3:02d}.{4:02d}/'
+MODIS_NRT = 'https://nrt3.modaps.eosdis.nasa.gov/api/v2/content/archives/allData/6/{0}/Recent/'
+ATMS_ARCHIVE = 'https://sounder.gesdisc.eosdis.nasa.gov/data/SNPP_Sounder_Level1/SNPPATMSL1B.2/{0}/{1:03d}/'
+
+# streamed downloads are written in blocks of this many bytes
+CHUNKSIZE = 1024 * 1024
+
+# MODIS/VIIRS sinusoidal tile grid, 36 x 18 tiles of equal size in projected meters
+SINUSOIDAL = '+proj=sinu +lon_0=0 +x_0=0 +y_0=0 +a=6371007.181 +b=6371007.181 +units=m +no_defs'
+TILESIZE = 1111950.5197665233
+GRIDXMIN = -20015109.355798
+GRIDYMAX = 10007554.677899
+GRIDSHAPE = (18,36)
+
+_listingIndex = None
+_footprintCache = None
+
+
+def _credentials(creds=None):
+    acct = netrc.netrc(creds)
+    usr,_,pswrd = acct.hosts['https://urs.earthdata.nasa.gov']
+    return usr,pswrd
 
-def viirs(date,h,v,outdir='./',creds=None,product=None):
-    """Function to download VIIRS NRT data for specified time and tile
 
-    Args:
-        date (datetime.datetime): Datetime object specifying which date the data of interest was acquired.
-        h (int): horizontal tile grid to fetch
-        v (int): vertical tile grid to fetch
-        outdir (str, optional): out directory to dump retrieved data to
-        default = './' or current working directory
-        creds (str, optional): path to .netrc file with NASA EarthData login in credentials
-        default = None
+def _pooledSession(workers=1):
+    s = requests.Session()
 
-    Returns:
-        None
-    """
+    adapter = HTTPAdapter(pool_connections=workers,pool_maxsize=workers)
+    s.mount('https://',adapter)
+    s.mount('http://',adapter)
 
-    if outdir[-1] != '/':
-        outdir = outdir+'/'
+    return s
 
-    acct = netrc.netrc(creds)
-    usr,_,pswrd = acct.hosts['https://urs.earthdata.nasa.gov']
 
-    today = datetime.datetime.now()
+def _session(creds=None,workers=1):
+    """Creates an EarthData authenticated session whose connection pool is
+    large enough to be shared by `workers` threads"""
+    s = _pooledSession(workers)
+    s.auth = _credentials(creds)
 
-    if outdir[-1] != '/':
-        outdir = outdir+'/'
+    return s
 
-    basename = '{0}.A{1}{2:03d}.h{3:02d}v{4:02d}.001.h5'
 
-    if (today - date).days > 8:
-        yr = date.year
-        dt = (date-datetime.datetime(yr,1,1)).days + 1
-        url = 'https://e4ftl01.cr.usgs.gov/DP102/VIIRS/{0}.001/{1}.{2:02d}.{3:02d}/'\
-                .format(product,yr,date.month,date.day)
-        with requests.Session() as s:
-            s.auth = (usr, pswrd)
-
-            r1 = s.request('get', url)
-            r = s.get(r1.url, auth=(usr, pswrd))
-
-            if r.ok:
-                result = r.content.split(' '.encode())
-                filtered = []
-                for i in result:
-                    if 'href'.encode() in i:
-                        this = i.split('"'.encode())[1]
-                        if this[-3:] =='.h5'.encode():
-                            filtered.append(this.decode("utf-8"))
-
-                for f in filtered:
-                    if 'h{:02d}'.format(h) in f\
-                    and 'v{:02d}'.format(v)  in f:
-                        filename = basename.format(product,yr,dt,h,v)
-                        outFile = outdir + filename
-                        if os.path.exists(outFile) != True:
-                            newurl = url+f
-                            r3 = s.request('get', newurl)
-                            r4 = s.get(r3.url, auth=(usr, pswrd))
-
-                            with open(outFile, 'wb') as this:
-                                this.write(r4.content) # Say
+def _get(s,url,headers=None):
+    # EarthData redirects to urs.earthdata.nasa.gov which drops the auth
+    # so the redirected url is requested again with the credentials.
+    # responses are streamed so only the headers are read until needed
+    r1 = s.request('get', url, headers=headers, stream=True)
+    if r1.ok:
+        return r1
+
+    r1.close()
+    return s.get(r1.url, auth=s.auth, headers=headers, stream=True)
 
+
+def _remoteSize(r):
+    # total size of the remote file from either a full or a partial response
+    if 'Content-Range' in r.headers:
+        total = r.headers['Content-Range'].split('/')[-1]
+        return int(total) if total.isdigit() else None
+    elif 'Content-Length' in r.headers:
+        return int(r.headers['Content-Length'])
     else:
-        yr = date.year
-        dt = (date-datetime.datetime(yr,1,1)).days + 1
+        return None
+
+
+def _remoteFileSize(s,url):
+    # size of the remote file from a one byte range request, so checking a
+    # local copy transfers no body and the pooled connection stays reusable
+    r = _get(s,url,headers={'Accept-Encoding':'identity','Range':'bytes=0-0'})
+    try:
+        if r.status_code == 206:
+            r.content
+        return _remoteSize(r) if r.ok else None
+    finally:
+        r.close()
+
+
+def _md5(path,chunkSize=CHUNKSIZE):
+    md5 = hashlib.md5()
+    with open(path,'rb') as f:
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+def _isComplete(path,size=None,checksum=None):
+    if os.path.exists(path) != True:
+        return False
+    if (size is not None) and (os.path.getsize(path) != size):
+        return False
+    if (checksum is not None) and (_md5(path) != checksum):
+        return False
+
+    return True
+
+
+def _download(s,url,outFile,checksum=None,chunkSize=CHUNKSIZE):
+    """Streams a remote file to disk in chunks. Data is written to a partial
+    file that is resumed with a Range request if a previous transfer was
+    interrupted and only renamed to outFile once its size (and checksum if
+    provided) is verified, so outFile is never left truncated."""
+    partFile = outFile + '.part'
+    headers = {'Accept-Encoding':'identity'}
+
+    if os.path.exists(outFile):
+        size = _remoteFileSize(s,url)
+        if _isComplete(outFile,size,checksum):
+            return outFile
+        # file from an earlier interrupted run, pick up where it left off
+        os.replace(outFile,partFile)
+
+    offset = os.path.getsize(partFile) if os.path.exists(partFile) else 0
+    if offset > 0:
+        headers['Range'] = 'bytes={}-'.format(offset)
+
+    r = _get(s,url,headers=headers)
+    try:
+        if r.status_code == 416:
+            # requested range starts at or past the end of the file
+            size = _remoteSize(r)
+            if (size is not None) and (size != offset):
+                # the partial file is longer than the remote file so it can not
+                # be a prefix of it, the transfer restarts from scratch
+                r.close()
+                os.remove(partFile)
+                return _download(s,url,outFile,checksum,chunkSize)
+            size = offset
+        else:
+            r.raise_for_status()
+            if r.status_code != 206:
+                # server ignored the range request so the transfer restarts
+                offset = 0
+            size = _remoteSize(r)
 
-        url = 'https://nrt3.modaps.eosdis.nasa.gov/api/v2/content/archives/allData/5000/{0}/Recent/'.format(product+'_NRT')
-        filename = basename.format(product+'_NRT',yr,dt,h,v)
-        fileUrl = url + filename
+            with open(partFile, 'ab' if offset > 0 else 'wb') as this:
+                for chunk in r.iter_content(chunk_size=chunkSize):
+                    this.write(chunk)
+    finally:
+        r.close()
 
-        outFile = outdir + filename
-        if os.path.exists(outFile) != True:
-            with requests.Session() as s:
-                s.auth = (usr, pswrd)
+    if (size is not None) and (os.path.getsize(partFile) != size):
+        raise IOError('incomplete download of {0}, received {1} of {2} bytes'.format(
+            url,os.path.getsize(partFile),size))
 
-                r1 = s.request('get', fileUrl)
-                r2 = s.get(r1.url, auth=(usr, pswrd))
+    if (checksum is not None) and (_md5(partFile) != checksum):
+        os.remove(partFile)
+        raise IOError('checksum mismatch for download of {0}'.format(url))
 
-                with open(outFile, 'wb') as f:
-                   f.write(r2.content)
+    os.replace(partFile,outFile)
 
     return outFile
 
-def modis(date,h,v,outdir='./',creds=None,product=None):
-    if outdir[-1] != '/':
-        outdir = outdir+'/'
 
-    acct = netrc.netrc(creds)
-    usr,_,pswrd = acct.hosts['https://urs.earthdata.nasa.gov']
+def _julianDay(date):
+    return (date-datetime.datetime(date.year,1,1)).days + 1
 
+
+def _isNrt(date):
     today = datetime.datetime.now()
+    return (today - date).days <= 8
+
+
+def _index():
+    # listing index shared by all fetch calls in the process, created lazily
+    global _listingIndex
+    if _listingIndex is None:
+        _listingIndex = listing.ListingIndex()
+
+    return _listingIndex
+
 
+def _footprints():
+    global _footprintCache
+    if _footprintCache is None:
+        _footprintCache = listing.FootprintCache()
+
+    return _footprintCache
+
+
+def _viirsUrls(s,date,tiles,product):
+    yr,dt = date.year,_julianDay(date)
+    basename = '{0}.A{1}{2:03d}.h{3:02d}v{4:02d}.001.h5'
+
+    targets = []
+    if _isNrt(date):
+        url = VIIRS_NRT.format(product+'_NRT')
+        for h,v in tiles:
+            filename = basename.format(product+'_NRT',yr,dt,h,v)
+            targets.append((url+filename,filename))
+
+    else:
+        url = VIIRS_ARCHIVE.format(product,yr,date.month,date.day)
+        for h,v in tiles:
+            f = _index().lookup(s,url,product,date,h,v)
+            if f is not None:
+                targets.append((url+f,basename.format(product,yr,dt,h,v)))
+
+    return targets
+
+
+def _modisUrls(s,date,tiles,product):
     if product:
         platform = product[:3]
         if platform.upper() == 'MOD':
@@ -109,156 +232,402 @@ def modis(date,h,v,outdir='./',creds=None,product=None):
     else:
         raise ValueError('product keyword was provided as None please specify product to fetch')
 
+    yr,dt = date.year,_julianDay(date)
     basename = '{0}.A{1}{2:03d}.h{3:02d}v{4:02d}.006.hdf'
 
-    if (today - date).days > 8:
-        yr = date.year
-        dt = (date-datetime.datetime(yr,1,1)).days + 1
-        url = 'https://e4ftl01.cr.usgs.gov/{0}/{1}.006/{2}.{3:02d}.{4:02d}/'\
-                .format(sensor,product,yr,date.month,date.day)
-
-        with requests.Session() as s:
-            s.auth = (usr, pswrd)
-
-            r1 = s.request('get', url)
-            r = s.get(r1.url, auth=(usr, pswrd))
-
-            if r.ok:
-                result = r.content.split(' '.encode())
-                filtered = []
-                for i in result:
-                    if 'href'.encode() in i:
-                        this = i.split('"'.encode())[1]
-                        if this[-4:] =='.hdf'.encode():
-                            filtered.append(this.decode("utf-8"))
-
-                for f in filtered:
-                    if 'h{:02d}'.format(h) in f\
-                    and 'v{:02d}'.format(v)  in f:
-                        filename = basename.format(product,yr,dt,h,v)
-                        outFile = outdir + filename
-                        if os.path.exists(outFile) != True:
-                            newurl = url+f
-                            r3 = s.request('get', newurl)
-                            r4 = s.get(r3.url, auth=(usr, pswrd))
-
-                            with open(outFile, 'wb') as this:
-                                this.write(r4.content) # Say
+    targets = []
+    if _isNrt(date):
+        url = MODIS_NRT.format(product)
+        for h,v in tiles:
+            filename = basename.format(product,yr,dt,h,v)
+            targets.append((url + filename[:-4] + '.NRT.hdf',filename))
 
     else:
-        yr = date.year
-        dt = (date-datetime.datetime(yr,1,1)).days + 1
+        url = MODIS_ARCHIVE.format(sensor,product,yr,date.month,date.day)
+        for h,v in tiles:
+            f = _index().lookup(s,url,product,date,h,v)
+            if f is not None:
+                targets.append((url+f,basename.format(product,yr,dt,h,v)))
 
-        url = 'https://nrt3.modaps.eosdis.nasa.gov/api/v2/content/archives/allData/6/{0}/Recent/'.format(product)
-        filename = basename.format(product,yr,dt,h,v)
-        fileUrl = url + filename[:-4] + '.NRT.hdf'
+    return targets
 
-        outFile = outdir + filename
-        if os.path.exists(outFile) != True:
-            with requests.Session() as s:
-                s.auth = (usr, pswrd)
 
-                r1 = s.request('get', fileUrl)
-                r2 = s.get(r1.url, auth=(usr, pswrd))
+def _cachedDownload(s,url,outFile,granuleCache=None):
+    # granules are identified by their archive file name in the cache
+    if granuleCache is None:
+        return _download(s,url,outFile)
 
-                with open(outFile, 'wb') as f:
-                   f.write(r2.content)
+    granule = url.split('/')[-1]
+    if granuleCache.link(granule,outFile) is None:
+        _download(s,url,outFile)
+        granuleCache.add(granule,outFile)
 
     return outFile
 
 
-def atms(date,region,outdir='./',creds=None):
+def _fetchTiles(urlFunc,date,tiles,outdir,creds,product,workers,granuleCache=None):
     if outdir[-1] != '/':
         outdir = outdir+'/'
 
-    acct = netrc.netrc(creds)
-    usr,_,pswrd = acct.hosts['https://urs.earthdata.nasa.gov']
+    workers = max(1,int(workers))
 
-    foy = datetime.datetime(date.year,1,1)
+    with _session(creds,workers) as s:
+        # the date directory is listed once for all of the tiles requested
+        targets = urlFunc(s,date,tiles,product)
+
+        def _worker(target):
+            # a tile that fails, e.g. an NRT tile not published yet, is left
+            # out instead of aborting the downloads of the other tiles
+            fileUrl,filename = target
+            try:
+                return _cachedDownload(s,fileUrl,outdir + filename,granuleCache)
+            except Exception as e:
+                print('download of {0} failed: {1}'.format(filename,e))
+                return None
+
+        with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            outFiles = [f for f in pool.map(_worker,targets) if f is not None]
+
+    return outFiles
+
+
+def viirs(date,h,v,outdir='./',creds=None,product=None,granuleCache=None):
+    """Function to download VIIRS NRT data for specified time and tile
+
+    Args:
+        date (datetime.datetime): Datetime object specifying which date the data of interest was acquired.
+        h (int): horizontal tile grid to fetch
+        v (int): vertical tile grid to fetch
+        outdir (str, optional): out directory to dump retrieved data to
+        default = './' or current working directory
+        creds (str, optional): path to .netrc file with NASA EarthData login in credentials
+        default = None
+        granuleCache (cache.GranuleCache, optional): shared granule store
+        default = None
+
+    Returns:
+        outFile (str): path to the downloaded file, None if the tile is not available
+    """
+    outFiles = viirs_many(date,[(h,v)],outdir=outdir,creds=creds,product=product,workers=1,
+                        granuleCache=granuleCache)
+
+    return outFiles[0] if outFiles else None
+
+
+def viirs_many(date,tiles,outdir='./',creds=None,product=None,workers=4,granuleCache=None):
+    """Function to download VIIRS data for multiple tiles concurrently
+
+    Args:
+        date (datetime.datetime): Datetime object specifying which date the data of interest was acquired.
+        tiles (list): list of (h,v) tuples to fetch, e.g. the output of findTiles
+        outdir (str, optional): out directory to dump retrieved data to
+        default = './' or current working directory
+        creds (str, optional): path to .netrc file with NASA EarthData login in credentials
+        default = None
+        workers (int, optional): number of concurrent downloads sharing one session
+        default = 4
+        granuleCache (cache.GranuleCache, optional): shared granule store, granules
+        already in it are linked into outdir instead of downloaded
+        default = None
+
+    Returns:
+        outFiles (list): paths to the downloaded files for the tiles available,
+        tiles that fail to download are reported and left out
+    """
+
+    return _fetchTiles(_viirsUrls,date,tiles,outdir,creds,product,workers,granuleCache)
+
+
+def modis(date,h,v,outdir='./',creds=None,product=None,granuleCache=None):
+    outFiles = modis_many(date,[(h,v)],outdir=outdir,creds=creds,product=product,workers=1,
+                        granuleCache=granuleCache)
+
+    return outFiles[0] if outFiles else None
+
+
+def modis_many(date,tiles,outdir='./',creds=None,product=None,workers=4,granuleCache=None):
+    """Function to download MODIS data for multiple tiles concurrently
+
+    Args:
+        date (datetime.datetime): Datetime object specifying which date the data of interest was acquired.
+        tiles (list): list of (h,v) tuples to fetch, e.g. the output of findTiles
+        outdir (str, optional): out directory to dump retrieved data to
+        default = './' or current working directory
+        creds (str, optional): path to .netrc file with NASA EarthData login in credentials
+        default = None
+        product (str): MODIS product short name, e.g. MOD09GA or MYD09GA
+        workers (int, optional): number of concurrent downloads sharing one session
+        default = 4
+        granuleCache (cache.GranuleCache, optional): shared granule store, granules
+        already in it are linked into outdir instead of downloaded
+        default = None
+
+    Returns:
+        outFiles (list): paths to the downloaded files for the tiles available,
+        tiles that fail to download are reported and left out
+    """
+
+    return _fetchTiles(_modisUrls,date,tiles,outdir,creds,product,workers,granuleCache)
 
-    jday = (date-foy).days + 1
 
-    url = 'https://sounder.gesdisc.eosdis.nasa.gov/data/SNPP_Sounder_Level1/SNPPATMSL1B.2/{0}/{1:03d}/'.format(
-    date.year,jday
-    )
+def atms(date,region,outdir='./',creds=None,workers=8,granuleCache=None):
+    if outdir[-1] != '/':
+        outdir = outdir+'/'
 
-    r = requests.get(url)
+    foy = datetime.datetime(date.year,1,1)
 
-    if r.ok:
-        result = r.content.split(' '.encode())
-        filtered = []
-        for i in result:
-            if 'href'.encode() in i:
-                this = i.split('"'.encode())[1]
-                if this[-4:] =='.xml'.encode():
-                    filtered.append(this.decode("utf-8"))
+    jday = (date-foy).days + 1
 
-    xmls = set([url+xml for xml in filtered])
-    sdrfiles = swathFilter(region,xmls)
+    url = ATMS_ARCHIVE.format(date.year,jday)
 
     fileList = []
 
-    with requests.Session() as s:
-        s.auth = (usr, pswrd)
+    with _session(creds,workers) as s:
+        xmls = set([url+xml for xml in _index().files(s,url,'.xml')])
+        sdrfiles = swathFilter(region,xmls,s=s,workers=workers)
+
         for sdr in sdrfiles:
             outFile = os.path.join(outdir,sdr)
-            if os.path.exists(outFile) != True:
-                newurl = url+sdr
-                r1 = s.request('get', newurl)
-                r2 = s.get(r1.url, auth=(usr, pswrd))
+            fileList.append(_cachedDownload(s,url+sdr,outFile,granuleCache))
 
-                with open(outFile, 'wb') as this:
-                    this.write(r2.content)
+    return fileList
 
-            fileList.append(outFile)
+def _parseFootprint(xmlStr):
+    data = xmltodict.parse(xmlStr)
+
+    ptList= data["S4PAGranuleMetaDataFile"]['SpatialDomainContainer']['HorizontalSpatialDomainContainer']['GPolygon']['Boundary']['Point']
+
+    verts = [(float(pt['PointLongitude']),float(pt['PointLatitude'])) for pt in ptList]
+    verts.append(verts[0])
+    x,y = list(zip(*verts))
+
+    maxDist = max([abs(x[-1]-x[i]) for i in range(len(x)-1)])
+
+    return data["S4PAGranuleMetaDataFile"]['DataGranule']['GranuleID'], verts, maxDist >= 60
 
-    return fileList
 
-def swathFilter(region,xmls):
+def swathFilter(region,xmls,s=None,workers=8,cache=None):
+    """Returns the names of the granules whose footprint intersects region.
+    Footprints are read from the cache and only the granule metadata files
+    not seen before are requested, concurrently over a pooled session
+
+    Args:
+        region (geopandas.GeoDataFrame): area of interest
+        xmls (iterable): urls of the granule metadata xml files
+        s (requests.Session, optional): session to request the metadata with
+        default = None, a pooled unauthenticated session is created
+        workers (int, optional): number of concurrent metadata requests
+        default = 8
+        cache (listing.FootprintCache, optional): footprint cache to use
+        default = None, the cache in the hydrafloods cache directory
+
+    Returns:
+        sdrnames (list): granule ids of the intersecting swaths
+    """
+    if cache is None:
+        cache = _footprints()
+
+    xmls = sorted(xmls)
+    records = cache.get(xmls)
+    missing = [xml for xml in xmls if xml not in records]
+
+    if missing:
+        workers = max(1,int(workers))
+        session = s if s is not None else _pooledSession(workers)
+
+        def _worker(xml):
+            r = session.get(xml)
+            r.raise_for_status()
+            return xml, _parseFootprint(r.content)
+
+        try:
+            with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                fetched = dict(pool.map(_worker,missing))
+        finally:
+            if s is None:
+                session.close()
+
+        cache.put(fetched)
+        records.update(fetched)
+
     geoms = []
     sdrnames = []
     for xml in xmls:
-        xmlStr = requests.get(xml).content
-        data = xmltodict.parse(xmlStr)
+        granule, verts, antimeridian = records[xml]
+        if antimeridian == False:
+            geoms.append(Polygon(verts))
+            sdrnames.append(granule)
 
-        ptList= data["S4PAGranuleMetaDataFile"]['SpatialDomainContainer']['HorizontalSpatialDomainContainer']['GPolygon']['Boundary']['Point']
+    selector = TileSelector(geoms,sdrnames)
 
-        verts = [(float(pt['PointLongitude']),float(pt['PointLatitude'])) for pt in ptList]
-        verts.append(verts[0])
-        x,y = list(zip(*verts))
+    return selector.select(region)
 
-        maxDist = max([abs(x[-1]-x[i]) for i in range(len(x)-1)])
 
-        if maxDist < 60:
-            geoms.append(Polygon(verts))
-            sdrnames.append(data["S4PAGranuleMetaDataFile"]['DataGranule']['GranuleID'])
+class TileSelector(object):
+    """Spatial index over a set of footprints that returns the ids of the
+    footprints intersecting a region. Candidates are prefiltered by bounding
+    box with an STRtree and then tested with intersects and touches predicates
+    against the region so no intersection geometries are computed. Footprints
+    that only touch the region are not selected
+
+    Args:
+        geoms (list): shapely geometries of the footprints
+        ids (list): ids of the footprints, one per geometry
+    """
+    def __init__(self,geoms,ids):
+        self.ids = list(ids)
+        self.tree = STRtree(list(geoms))
+
+        return
+
+    @classmethod
+    def fromFrame(cls,tiles):
+        """Builds a selector from a geopandas dataframe with either h/v or
+        PATH/ROW tile columns"""
+        if 'PATH' in tiles.columns:
+            h,v = 'PATH','ROW'
+        elif 'h' in tiles.columns:
+            h,v = 'h','v'
+        else:
+            raise AttributeError('cannot parse the needed tile information from provided geopadas dataframe')
 
-    swathGeo = gpd.GeoDataFrame(pd.DataFrame({'sdr':sdrnames,'geometry':geoms}),geometry=geoms)
+        ids = list(zip(tiles[h].tolist(),tiles[v].tolist()))
 
-    swathGeo.crs = {'init':'epsg:4326'}
+        return cls(tiles.geometry.values,ids)
 
-    intersection = gpd.overlay(region,swathGeo,how='intersection')
+    def select(self,region):
+        """Returns the ids of the footprints sharing area with region
 
-    return list(intersection.sdr)
+        Args:
+            region (geopandas.GeoDataFrame | shapely geometry): area of interest
 
+        Returns:
+            ids (list): ids of the intersecting footprints in index order
+        """
+        if hasattr(region,'geometry'):
+            region = unary_union(region.geometry.values)
 
-def findTiles(region, tiles):
+        idx = self.tree.query(region,predicate='intersects')
+        # footprints sharing only an edge or a corner with the region have no
+        # area in common with it and are left out, as an overlay leaves them
+        geoms = self.tree.geometries
+        idx = [i for i in idx if region.touches(geoms[i]) != True]
+
+        return [self.ids[i] for i in sorted(idx)]
+
+
+SinusoidalTile = namedtuple('SinusoidalTile',['h','v','window','geotransform'])
+
+
+@lru_cache(maxsize=1)
+def _toSinusoidal():
+    return Transformer.from_crs('EPSG:4326',SINUSOIDAL,always_xy=True)
+
+
+def tileGeotransform(h,v,nPixels=2400):
+    """Returns the exact GDAL geotransform of a sinusoidal grid tile
+
+    Args:
+        h (int): horizontal tile grid
+        v (int): vertical tile grid
+        nPixels (int, optional): number of pixels along a tile side,
+        1200 for 1km, 2400 for 500m and 4800 for 250m data
+        default = 2400
+
+    Returns:
+        gt (tuple): geotransform of the tile in sinusoidal meters
+    """
+    res = TILESIZE / nPixels
+    return (GRIDXMIN + h*TILESIZE, res, 0, GRIDYMAX - v*TILESIZE, 0, -res)
+
+
+def sinusoidalTiles(region,nPixels=2400,densify=0.25):
+    """Calculates the sinusoidal grid tiles covering a region directly from
+    the grid definition along with the pixel window of the region in each tile
+
+    Args:
+        region (geopandas.GeoDataFrame | shapely geometry): area of interest in geographic coordinates
+        nPixels (int, optional): number of pixels along a tile side used for the windows
+        default = 2400
+        densify (float, optional): maximum segment length in degrees the region
+        boundary is split into before projecting so curved edges are captured
+        default = 0.25
+
+    Returns:
+        tiles (list): SinusoidalTile namedtuples of (h, v, window, geotransform)
+        where window is the (xoff, yoff, xsize, ysize) pixel window of the region,
+        tiles the region only touches are left out
+    """
+    if hasattr(region,'geometry'):
+        region = unary_union(region.geometry.values)
+
+    region = reproject(_toSinusoidal().transform,region.segmentize(densify))
+    minx,miny,maxx,maxy = region.bounds
+
+    nv,nh = GRIDSHAPE
+    h0 = max(int(np.floor((minx-GRIDXMIN)/TILESIZE)),0)
+    h1 = min(int(np.floor((maxx-GRIDXMIN)/TILESIZE)),nh-1)
+    v0 = max(int(np.floor((GRIDYMAX-maxy)/TILESIZE)),0)
+    v1 = min(int(np.floor((GRIDYMAX-miny)/TILESIZE)),nv-1)
+
+    tiles = []
+    for v in range(v0,v1+1):
+        for h in range(h0,h1+1):
+            gt = tileGeotransform(h,v,nPixels)
+            tx0,ty1 = gt[0],gt[3]
+            tile = box(tx0,ty1-TILESIZE,tx0+TILESIZE,ty1)
+            if region.intersects(tile) != True:
+                continue
+
+            # tiles the region only touches, or grazes through projection
+            # round off, share a line or a sliver with it but no pixel
+            part = region.intersection(tile)
+            bx0,by0,bx1,by1 = part.bounds
+            res = gt[1]
+            tol = 1e-3*res
+            if part.area < tol*res or min(bx1-bx0,by1-by0) < tol:
+                continue
+
+            xoff = int(np.clip(np.floor((bx0-tx0)/res),0,nPixels))
+            yoff = int(np.clip(np.floor((ty1-by1)/res),0,nPixels))
+            xend = int(np.clip(np.ceil((bx1-tx0)/res),0,nPixels))
+            yend = int(np.clip(np.ceil((ty1-by0)/res),0,nPixels))
+
+            tiles.append(SinusoidalTile(h,v,(xoff,yoff,xend-xoff,yend-yoff),gt))
+
+    return tiles
+
+
+@lru_cache(maxsize=1)
+def gridSelector():
+    """Returns the TileSelector of the bundled VIIRS/MODIS sinusoidal tile
+    grid, which is only read and indexed on the first call"""
+    gridFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),'data','viirs_sinu.geojson')
+
+    return TileSelector.fromFrame(gpd.read_file(gridFile))
+
+
+def findTiles(region, tiles=None):
     """Returns the tile IDs that need to be downloaded for
-    a given region bounded by *region*."""
+    a given region bounded by *region*.
+
+    Args:
+        region (geopandas.GeoDataFrame): area of interest
+        tiles (geopandas.GeoDataFrame | TileSelector, optional): tile grid to select from
+        default = None, the VIIRS/MODIS sinusoidal grid calculated with sinusoidalTiles
+
+    Returns:
+        ids (list): (h,v) or (path,row) tuples of the intersecting tiles
+    """
 
     if region is None:
         raise ValueError("No bounding box provided for study area. Aborting download!")
-        ids = None
-    else:
-        intersection = gpd.overlay(region,tiles,how='intersection')
-
-        if 'PATH' in intersection.columns:
-            h,v = 'PATH','ROW'
-        elif 'h' in intersection.columns:
-            h,v = 'h','v'
-        else:
-            raise AttributeError('cannot parse the needed tile information from provided geopadas dataframe')
 
-        ids = [(intersection.iloc[i][h],intersection.iloc[i][v]) for i in range(len(intersection))]
+    if tiles is None:
+        return [(tile.h,tile.v) for tile in sinusoidalTiles(region)]
+    elif isinstance(tiles,TileSelector):
+        selector = tiles
+    else:
+        selector = TileSelector.fromFrame(tiles)
 
-    return ids
+    return selector.select(region)
@@ -9,7 +9,7 @@ import warnings
 import pandas as pd
 import geopandas as gpd
 
-from . import utils
+from . import utils, fetch, ingest, preprocess, watch, cache
 from .processing import *
 
 ee.Initialize()
@@ -65,6 +65,14 @@ class hydrafloods(object):
             else:
                 self.credentials = None
 
+            if 'granuleCache' in confKeys:
+                # granules downloaded by any configuration sharing the cache are reused
+                cacheConf = conf['granuleCache'] if conf['granuleCache'] else {}
+                maxSize = cacheConf['maxSize'] if 'maxSize' in cacheConf else 50
+                self.granuleCache = cache.GranuleCache(cacheConf.get('path'),maxBytes=int(maxSize*1024**3))
+            else:
+                self.granuleCache = None
+
             if 'stagingBucket' in confKeys:
                 self.stagingBucket = conf['stagingBucket']
             else:
@@ -132,7 +140,15 @@ class hydrafloods(object):
                     if os.path.exists(prodDir) != True:
                         os.mkdir(prodDir)
 
-                    geotiffs = worker.extract(dt,self.region,outdir=prodDir,creds=self.credentials,gridding_radius=50000)
+                    if 'gridding' in paramKeys:
+                        gridding = params['gridding']
+                    else:
+                        gridding = 'bilinear'
+
+                    geotiffs = worker.extract(dt,self.region,outdir=prodDir,creds=self.credentials,gridding_radius=50000,
+                                              granuleCache=self.granuleCache,method=gridding,
+                                              workers=params.get('workers'),max_memory=params.get('maxMemory'),
+                                              inMemory=params.get('inMemory',False))
                     worker.load(geotiffs,self.stagingBucket,collId)
 
                 if 'seed' in paramKeys:
@@ -154,7 +170,7 @@ class hydrafloods(object):
 
                 if (today - dt).days < 5:
                     avail = today - datetime.timedelta(5)
-                    raise NotImplementedError('NRT processing for VIIRS or MODIS has not been implemented, please select a date prior to {}'.format(avail))
+                    raise NotImplementedError('NRT processing for VIIRS or MODIS has not been implemented, please select a date prior to {} or use watch to download NRT granules to the workdir as they arrive'.format(avail))
                 else:
                     minDate = (dt - datetime.timedelta(45)).strftime('%Y-%m-%d')
                     maxDate = (dt + datetime.timedelta(1)).strftime('%Y-%m-%d')
@@ -182,6 +198,10 @@ class hydrafloods(object):
                         nIters=100
                         probTreshold=0.75
 
+                    # granule handling option used by watch, not a water mapping parameter
+                    if 'keepOriginal' in paramKeys:
+                        params.pop('keepOriginal')
+
                     waterImage = worker.waterMap(date,hand,probablistic=runProbs,**params)
                     waterImage = waterImage\
                         .set({'system:time_start':ee.Date(date).millis(),'sensor':product})
@@ -206,6 +226,47 @@ class hydrafloods(object):
 
         return
 
+    def watch(self,product,interval=300,days=1,workers=4):
+        """Runs until interrupted, downloading NRT granules for the configured
+        region as soon as they appear in the archive and subsetting them to the
+        region in workdir, VIIRS subsets are also preprocessed to local geotiffs.
+        The outputs stay local, nothing is uploaded to the staging bucket or
+        Earth Engine and no water map is made
+
+        Args:
+            product (str): either 'viirs' or 'modis'
+            interval (int, optional): seconds between polls of the archive
+            default = 300
+            days (int, optional): number of days back from today to watch
+            default = 1
+            workers (int, optional): number of granules processed concurrently
+            default = 4
+        """
+        products = {'viirs':'VNP09GA','modis':'MOD09GA'}
+        if product not in products:
+            raise NotImplementedError('watching the NRT archive is only implemented for viirs and modis')
+
+        tiles = fetch.findTiles(self.region)
+
+        # keepOriginal: False in the viirs process config removes granules once they are subset
+        params = self.viirsParams if hasattr(self,'viirsParams') else {}
+        keepOriginal = params.get('keepOriginal',True)
+
+        def _process(granule,date,h,v):
+            subsets = ingest.granules([granule],self.region,sensor=product,keepOriginal=keepOriginal)
+            if product == 'viirs':
+                for f in subsets:
+                    preprocess.viirs(f)
+            return
+
+        watcher = watch.Watcher(product,products[product],tiles,workdir=self.workdir,
+                                creds=self.credentials,callback=_process,
+                                interval=interval,days=days,workers=workers,
+                                granuleCache=self.granuleCache)
+        watcher.run()
+
+        return
+
     def run_tests(self):
         raise NotImplementedError('test functionality not implemented...please ')
         return
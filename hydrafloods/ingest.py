@@ -0,0 +1,209 @@
+from __future__ import absolute_import
+import os
+import re
+import numpy as np
+import xarray as xr
+from osgeo import gdal
+
+from . import fetch, preprocess
+
+# ratio of the 500m reference grid to the resolution of each field
+FACTORS = {'500m':1,'1km':2}
+
+MODIS_GRID = 'HDF4_EOS:EOS_GRID:"{0}":MODIS_Grid_{1}_2D:{2}'
+MODIS_FIELDS = [('sur_refl_b0{}_1'.format(i),'500m') for i in range(1,8)] + \
+               [('state_1km_1','1km'),('SensorZenith_1','1km')]
+
+TILEID = re.compile(r'\.h(\d{2})v(\d{2})\.')
+
+
+def _alignWindow(window,tileSize):
+    # expand the window to even 500m pixels so it maps exactly onto the 1km grid
+    if window is None:
+        return 0,0,tileSize,tileSize
+
+    xoff,yoff,xsize,ysize = window
+    xend,yend = xoff+xsize, yoff+ysize
+    xoff,yoff = xoff - xoff%2, yoff - yoff%2
+    xend,yend = min(xend + xend%2,tileSize), min(yend + yend%2,tileSize)
+
+    return xoff,yoff,xend-xoff,yend-yoff
+
+
+def _outName(infile,outdir):
+    name,_ = os.path.splitext(os.path.basename(infile))
+    if outdir is None:
+        outdir = os.path.dirname(infile)
+
+    return os.path.join(outdir,name + '.nc')
+
+
+def _coordinates(dims,attrs,xoff,yoff,xsize,ysize,nPixels):
+    # sinusoidal pixel centres of the window, without a decreasing y coordinate
+    # the netCDF driver assumes the rows are stored bottom-up and flips them
+    if 'HorizontalTileNumber' in attrs:
+        x0,res,_,y0,_,_ = fetch.tileGeotransform(attrs['HorizontalTileNumber'],
+                                                 attrs['VerticalTileNumber'],nPixels)
+    else:
+        x0,res,y0 = 0,1,0
+
+    y = y0 - (yoff + np.arange(ysize) + 0.5)*res
+    x = x0 + (xoff + np.arange(xsize) + 0.5)*res
+
+    return {dims[0]:(dims[0],y,{'standard_name':'projection_y_coordinate','units':'m'}),
+            dims[1]:(dims[1],x,{'standard_name':'projection_x_coordinate','units':'m'})}
+
+
+def subset(fields,window,outFile,attrs=None,tileSize=2400,complevel=4,chunks=256):
+    """Reads a pixel window of granule subdatasets and writes them to a chunked
+    and compressed netCDF file
+
+    Args:
+        fields (list): list of (name, gdal path, resolution) for the subdatasets to keep,
+        resolution is one of the FACTORS keys
+        window (tuple): (xoff, yoff, xsize, ysize) window in 500m pixels, None for the whole tile
+        outFile (str): path of the netCDF file to write
+        attrs (dict, optional): global attributes to store with the subset
+        default = None
+        tileSize (int, optional): number of 500m pixels along a tile side
+        default = 2400
+        complevel (int, optional): zlib compression level
+        default = 4
+        chunks (int, optional): chunk size along each dimension
+        default = 256
+
+    Returns:
+        outFile (str): path to the written subset
+    """
+    xoff,yoff,xsize,ysize = _alignWindow(window,tileSize)
+
+    attrs = dict(attrs) if attrs else {}
+    attrs.update({'xoff':xoff,'yoff':yoff,'tileSize':tileSize})
+
+    dataVars = {}
+    coords = {}
+    encoding = {}
+    for name,path,res in fields:
+        f = FACTORS[res]
+        ds = gdal.Open(path)
+        data = ds.ReadAsArray(xoff//f,yoff//f,xsize//f,ysize//f)
+        ds = None
+
+        dims = ('y_{}'.format(res),'x_{}'.format(res))
+        if dims[0] not in coords:
+            coords.update(_coordinates(dims,attrs,xoff//f,yoff//f,xsize//f,ysize//f,tileSize//f))
+            encoding.update({d:{'_FillValue':None} for d in dims})
+
+        dataVars[name] = (dims,data)
+        encoding[name] = {'zlib':True,'complevel':complevel,'shuffle':True,
+                          'chunksizes':(min(chunks,data.shape[0]),min(chunks,data.shape[1]))}
+
+    tmpFile = outFile + '.part'
+    xr.Dataset(dataVars,coords=coords,attrs=attrs).to_netcdf(tmpFile,engine='netcdf4',encoding=encoding)
+    os.replace(tmpFile,outFile)
+
+    return outFile
+
+
+def viirs(infile,window=None,outdir=None,keepOriginal=True,**kwargs):
+    """Extracts the VNP09GA subdatasets read by preprocess.viirs for a window of
+    the tile into a compact subset that preprocess.viirs reads in place of the granule
+
+    Args:
+        infile (str): path to the VNP09GA granule
+        window (tuple, optional): (xoff, yoff, xsize, ysize) window in 500m pixels,
+        e.g. from fetch.sinusoidalTiles
+        default = None, the whole tile
+        outdir (str, optional): directory to write the subset to
+        default = None, the directory of infile
+        keepOriginal (bool, optional): keep the original granule after ingesting
+        default = True
+        **kwargs: keyword arguments passed to subset
+
+    Returns:
+        outFile (str): path to the subset
+    """
+    band = gdal.Open(preprocess.viirsSubdataset(infile,'1km',preprocess.VIIRS_FIELD.format('QF',1)))
+    metadata = band.GetMetadata()
+    band = None
+
+    h,v = TILEID.search(os.path.basename(infile)).groups()
+    attrs = {'HorizontalTileNumber':int(h),'VerticalTileNumber':int(v)}
+    for key in ['StartTime','EndTime','RangeBeginningDate']:
+        value = preprocess._metadataValue(metadata,key)
+        if value is not None:
+            attrs[key] = value
+
+    fields = [(preprocess.VIIRS_FIELD.format('QF',q),'1km') for q in [1,2]]
+    fields += [(preprocess.VIIRS_FIELD.format(preprocess.VIIRS_MODE[i],b),preprocess.VIIRS_RES[i])
+               for i in range(len(preprocess.VIIRS_BANDS)) for b in preprocess.VIIRS_BANDS[i]]
+    fields = [(name,preprocess.viirsSubdataset(infile,res,name),res) for name,res in fields]
+
+    outFile = _outName(infile,outdir)
+    subset(fields,window,outFile,attrs=attrs,**kwargs)
+
+    if keepOriginal == False:
+        os.remove(infile)
+
+    return outFile
+
+
+def modis(infile,window=None,outdir=None,keepOriginal=True,**kwargs):
+    """Extracts the MOD09GA/MYD09GA reflectance, state and view angle subdatasets
+    for a window of the tile into a compact subset
+
+    Args:
+        infile (str): path to the MOD09GA/MYD09GA granule
+        window (tuple, optional): (xoff, yoff, xsize, ysize) window in 500m pixels
+        default = None, the whole tile
+        outdir (str, optional): directory to write the subset to
+        default = None, the directory of infile
+        keepOriginal (bool, optional): keep the original granule after ingesting
+        default = True
+        **kwargs: keyword arguments passed to subset
+
+    Returns:
+        outFile (str): path to the subset
+    """
+    h,v = TILEID.search(os.path.basename(infile)).groups()
+    attrs = {'HorizontalTileNumber':int(h),'VerticalTileNumber':int(v)}
+
+    fields = [(name,MODIS_GRID.format(infile,res,name),res) for name,res in MODIS_FIELDS]
+
+    outFile = _outName(infile,outdir)
+    subset(fields,window,outFile,attrs=attrs,**kwargs)
+
+    if keepOriginal == False:
+        os.remove(infile)
+
+    return outFile
+
+
+def granules(files,region,sensor='viirs',**kwargs):
+    """Subsets downloaded granules to the pixel windows covering a region
+
+    Args:
+        files (list): paths to the granules, e.g. the output of fetch.viirs_many
+        region (geopandas.GeoDataFrame): area of interest
+        sensor (str, optional): either 'viirs' or 'modis'
+        default = 'viirs'
+        **kwargs: keyword arguments passed to viirs or modis, e.g. keepOriginal
+
+    Returns:
+        outFiles (list): paths to the subsets
+    """
+    funcs = {'viirs':viirs,'modis':modis}
+    if sensor not in funcs:
+        raise ValueError('sensor keyword must be one of {}'.format(list(funcs.keys())))
+
+    windows = {(t.h,t.v):t.window for t in fetch.sinusoidalTiles(region)}
+
+    outFiles = []
+    for f in files:
+        h,v = TILEID.search(os.path.basename(f)).groups()
+        window = windows.get((int(h),int(v)))
+        if window is None:
+            continue
+        outFiles.append(funcs[sensor](f,window=window,**kwargs))
+
+    return outFiles
@@ -0,0 +1,237 @@
+from __future__ import absolute_import
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import datetime
+import threading
+
+from . import utils
+
+HREF = re.compile(r'href="([^"]+)"'.encode())
+GRANULE = re.compile(r'^(?P<product>[A-Za-z0-9_]+)\.A(?P<year>\d{4})(?P<doy>\d{3})\.h(?P<h>\d{2})v(?P<v>\d{2})\.')
+
+
+def granuleKey(product,date,h,v):
+    """Returns the key a granule is stored under in the listing index
+
+    Args:
+        product (str): product short name as it appears in the file name, e.g. VNP09GA
+        date (datetime.datetime): acquisition date of the granule
+        h (int): horizontal tile grid
+        v (int): vertical tile grid
+
+    Returns:
+        key (str): index key of the form 'product|YYYYDDD|h|v'
+    """
+    doy = (date-datetime.datetime(date.year,1,1)).days + 1
+    return '{0}|{1}{2:03d}|{3:d}|{4:d}'.format(product,date.year,doy,int(h),int(v))
+
+
+def parseListing(content):
+    """Parses the html of an archive directory page into the linked file names
+    and the (product, date, h, v) -> filename map of the tiled granules found
+
+    Args:
+        content (bytes): raw html of the directory page
+
+    Returns:
+        names (list): file names linked from the page
+        granules (dict): map of granuleKey strings to file names
+    """
+    names = []
+    granules = {}
+    for href in HREF.findall(content):
+        name = os.path.basename(href.decode('utf-8').rstrip('/'))
+        if not name:
+            continue
+        names.append(name)
+
+        match = GRANULE.match(name)
+        if match:
+            key = '{0}|{1}{2}|{3:d}|{4:d}'.format(match.group('product'),
+                match.group('year'),match.group('doy'),
+                int(match.group('h')),int(match.group('v')))
+            # several files per granule can be linked (e.g. .h5 and .h5.xml)
+            # the data file is the shortest name
+            if (key not in granules) or (len(name) < len(granules[key])):
+                granules[key] = name
+
+    return names, granules
+
+
+class ListingIndex(object):
+    """Cache of parsed archive directory listings. Each directory is requested
+    and parsed once, kept in memory and persisted to disk so tile lookups are
+    dictionary hits. Entries older than ttl seconds are revalidated with a
+    conditional request (ETag/If-Modified-Since) which only re-downloads and
+    re-parses the page when it changed on the server.
+
+    Args:
+        cachedir (str, optional): directory to persist the parsed listings to
+        default = utils.cache_dir('listings')
+        ttl (int, optional): seconds a listing is used before it is revalidated
+        default = 3600
+    """
+    def __init__(self,cachedir=None,ttl=3600):
+        if cachedir is None:
+            cachedir = utils.cache_dir('listings')
+        self.cachedir = cachedir
+        self.ttl = ttl
+
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        return
+
+    def _path(self,url):
+        return os.path.join(self.cachedir,hashlib.sha1(url.encode()).hexdigest()+'.json')
+
+    def _load(self,url):
+        if url in self._entries:
+            return self._entries[url]
+
+        path = self._path(url)
+        if os.path.exists(path):
+            try:
+                with open(path,'r') as f:
+                    entry = json.load(f)
+            except ValueError:
+                entry = None
+        else:
+            entry = None
+
+        if entry is not None:
+            self._entries[url] = entry
+
+        return entry
+
+    def _save(self,url,entry):
+        self._entries[url] = entry
+
+        path = self._path(url)
+        tmp = '{0}.{1}.tmp'.format(path,threading.get_ident())
+        with open(tmp,'w') as f:
+            json.dump(entry,f)
+        os.replace(tmp,path)
+
+        return
+
+    def entry(self,s,url,refresh=False):
+        """Returns the parsed listing for a directory url, requesting it only
+        when it is not cached or the cached entry is older than the ttl
+
+        Args:
+            s (requests.Session): authenticated session used for the request
+            url (str): url of the archive directory
+            refresh (bool, optional): force revalidation of a cached entry
+            default = False
+
+        Returns:
+            entry (dict): parsed listing with 'names' and 'granules' keys
+        """
+        # imported here to avoid a circular import with fetch
+        from .fetch import _get
+
+        with self._lock:
+            entry = self._load(url)
+            now = time.time()
+            if (entry is not None) and (refresh == False) and (now - entry['checked'] < self.ttl):
+                return entry
+
+            headers = {}
+            if entry is not None:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('modified'):
+                    headers['If-Modified-Since'] = entry['modified']
+
+            r = _get(s,url,headers=headers)
+            try:
+                if (r.status_code == 304) and (entry is not None):
+                    entry['checked'] = now
+                elif r.ok:
+                    names, granules = parseListing(r.content)
+                    entry = {'url':url,
+                             'etag':r.headers.get('ETag'),
+                             'modified':r.headers.get('Last-Modified'),
+                             'checked':now,
+                             'names':names,
+                             'granules':granules}
+                else:
+                    # directory not available (yet), nothing to cache
+                    return {'url':url,'names':[],'granules':{}}
+            finally:
+                r.close()
+
+            self._save(url,entry)
+
+        return entry
+
+    def files(self,s,url,suffix=''):
+        """Returns the names of the files in an archive directory ending with suffix"""
+        return [name for name in self.entry(s,url)['names'] if name.endswith(suffix)]
+
+    def lookup(self,s,url,product,date,h,v):
+        """Returns the file name of the granule for a product, date and tile in
+        an archive directory or None if it is not listed"""
+        return self.entry(s,url)['granules'].get(granuleKey(product,date,h,v))
+
+
+class FootprintCache(object):
+    """On-disk cache of parsed granule footprints keyed by metadata url so the
+    metadata of a granule is only requested once across regions and reruns
+
+    Args:
+        path (str, optional): sqlite database file to store the footprints in
+        default = utils.cache_dir()/footprints.sqlite
+    """
+    def __init__(self,path=None):
+        if path is None:
+            path = os.path.join(utils.cache_dir(),'footprints.sqlite')
+        self.path = path
+
+        with self._connect() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS footprints '
+                        '(url TEXT PRIMARY KEY, granule TEXT, verts TEXT, antimeridian INTEGER)')
+
+        return
+
+    def _connect(self):
+        return sqlite3.connect(self.path,timeout=60)
+
+    def get(self,urls):
+        """Returns a dict of url -> (granuleId, vertices, crossesAntimeridian)
+        for the urls that are in the cache"""
+        urls = list(urls)
+        records = {}
+
+        con = self._connect()
+        try:
+            # sqlite limits the number of variables per statement
+            for i in range(0,len(urls),500):
+                batch = urls[i:i+500]
+                query = 'SELECT url, granule, verts, antimeridian FROM footprints WHERE url IN ({})'\
+                    .format(','.join('?'*len(batch)))
+                for url,granule,verts,antimeridian in con.execute(query,batch):
+                    records[url] = (granule,[tuple(v) for v in json.loads(verts)],bool(antimeridian))
+        finally:
+            con.close()
+
+        return records
+
+    def put(self,records):
+        """Stores a dict of url -> (granuleId, vertices, crossesAntimeridian)"""
+        rows = [(url,granule,json.dumps(verts),int(antimeridian))
+                for url,(granule,verts,antimeridian) in records.items()]
+
+        con = self._connect()
+        try:
+            with con:
+                con.executemany('INSERT OR REPLACE INTO footprints VALUES (?,?,?,?)',rows)
+        finally:
+            con.close()
+
+        return
@@ -1,176 +1,469 @@
 from __future__ import print_function,division
 import numpy as np
 import pywt
-from scipy import ndimage,signal
-from matplotlib import colors
-from sklearn.decomposition import PCA
-from . import io,utils
+from scipy import ndimage
+from . import utils
 
-def _interp(r,g,b,i,method='cubic'):
+# rough peak bytes held per output pixel while a window is processed, used to
+# size the windows of tiled to a memory budget
+BYTES_PER_PIXEL = 320
+
+# number of low resolution rows added around a window so the cubic spline
+# interpolation of a window matches the interpolation of the whole image
+HALO = 16
+
+# number of pixels the PCA fit and projection handle at a time
+CHUNK = 1024**2
+
+def _interp(r,g,b,i,method='cubic',dtype=np.float64):
     code = {'cubic':3,'bilinear':1,'nearest':0}
-    R = ndimage.zoom(r,2,order=code[method])
-    G = ndimage.zoom(g,2,order=code[method])
-    B = ndimage.zoom(b,2,order=code[method])
-    I = ndimage.zoom(i,2,order=code[method])
-    
+    # interpolated straight into arrays of the working dtype
+    R,G,B,I = [utils.upsample(band,2,order=code[method],
+                              out=np.empty((band.shape[0]*2,band.shape[1]*2),dtype=dtype))
+               for band in (r,g,b,i)]
+
     return R,G,B,I
 
-def _rescale(data,maxVal,minVal,stretch=False,inverse=False):
-    if stretch:
-        if inverse:
-            out = ((maxVal-minVal) * (maxVal-data)) / (maxVal-minVal)
+def _interpWindow(data,r0,r1,outShape,order=3,halo=HALO,dtype=np.float64):
+    # rows r0:r1 of ndimage.zoom(data,2) computed from a haloed slice of data,
+    # zoom maps output pixel j to input coordinate j*(nIn-1)/(nOut-1)
+    nIn,nOut = data.shape, outShape
+    ry = np.arange(r0,r1) * (nIn[0]-1) / (nOut[0]-1)
+    cx = np.arange(nOut[1]) * (nIn[1]-1) / (nOut[1]-1)
+
+    i0 = max(int(np.floor(ry[0]))-halo,0)
+    i1 = min(int(np.ceil(ry[-1]))+halo+1,nIn[0])
+
+    yy,xx = np.meshgrid(ry-i0,cx,indexing='ij')
+    return ndimage.map_coordinates(np.asarray(data[i0:i1],dtype=np.float64),[yy,xx],
+                                   order=order,mode='constant',output=dtype)
+
+def _rescale(data,maxVal,minVal,stretch=False,inverse=False,out=None):
+    # out=data rescales in place, the dtype of out is kept
+    if inverse:
+        out = np.subtract(maxVal,data,out=out)
+    else:
+        out = np.subtract(data,minVal,out=out)
+
+    if stretch == False:
+        out /= (maxVal-minVal)
+
+    return out
+
+
+def _histMatcher(P,S,windows):
+    # histogram matching of P to S as utils.hist_match, with the histogram of
+    # P accumulated window by window and the template CDF of S cached
+    return utils.template_cdf(S).matcher(P[r0:r1] for r0,r1 in windows)
+
+
+def _minMax(arrays,stats=None):
+    # running (max, min) over an iterable of arrays
+    vmax,vmin = stats if stats else (-np.inf,np.inf)
+    for a in arrays:
+        vmax,vmin = max(vmax,a.max()),min(vmin,a.min())
+
+    return vmax,vmin
+
+
+def _hsvStats(windows,weight=0.3):
+    # value channel of rgb_to_hsv is the maximum of R, G and B
+    return {'v':_minMax(np.maximum(np.maximum(R,G),B) for R,G,B,I,P in windows())}
+
+def _hsvApply(R,G,B,I,P,stats,weight=0.3):
+    data_max, data_min = stats['v']
+    intensity = np.multiply(I,-weight)
+    intensity += P
+    _rescale(intensity,data_max,data_min,out=intensity)
+
+    # hue and saturation are kept so the conversion to hsv and back amounts
+    # to scaling rgb by the new over the old value, gray pixels take the new value
+    ratio = np.maximum(R,G)
+    np.maximum(ratio,B,out=ratio)
+    gray = ratio == 0
+    np.divide(intensity,ratio,out=ratio,where=~gray)
+
+    panImg = np.empty(R.shape+(3,),dtype=R.dtype)
+    for b,band in enumerate((R,G,B)):
+        np.multiply(band,ratio,out=panImg[:,:,b])
+    panImg[gray] = intensity[gray][:,np.newaxis]
+
+    return panImg
+
+
+def _waveletRaw(R,G,B,I,P,rows=slice(None),wavelet='haar',level=1,rule='substitute'):
+    # the transform is linear, so under substitute and additive a fused band
+    # is the reconstruction of its own approximation (or of itself) plus the
+    # reconstruction of the pan details, computed once and shared by all bands.
+    # max picks coefficients per band and is reconstructed band by band
+    if rule not in WAVELET_RULES:
+        raise ValueError('rule must be one of {}'.format(WAVELET_RULES))
+
+    shape = R.shape
+    panCoeffs = pywt.wavedec2(P,wavelet,level=level)
+    panDetail = None
+    if rule != 'max':
+        panDetail = pywt.waverec2([None]+panCoeffs[1:],wavelet)[:shape[0],:shape[1]][rows]
+
+    panImg = np.empty(R[rows].shape+(4,),dtype=R.dtype)
+    for b,band in enumerate((R,G,B,I)):
+        if rule == 'additive':
+            # band details are kept, the band reconstructs to itself
+            fused = band
+        else:
+            coeffs = pywt.wavedec2(band,wavelet,level=level)
+            for i in range(1,len(coeffs)):
+                if rule == 'substitute':
+                    coeffs[i] = (None,None,None)
+                else:
+                    # larger detail in magnitude
+                    coeffs[i] = tuple(np.where(np.abs(pan) > np.abs(detail),pan,detail)
+                                      for detail,pan in zip(coeffs[i],panCoeffs[i]))
+            fused = pywt.waverec2(coeffs,wavelet)[:shape[0],:shape[1]]
+
+        if panDetail is None:
+            panImg[:,:,b] = fused[rows]
+        else:
+            np.add(fused[rows],panDetail,out=panImg[:,:,b])
+
+    return panImg
+
+def _waveletMargins(wavelet='haar',level=1,rule='substitute'):
+    # windows start on multiples of 2**level so their decimation matches the
+    # whole image, with a halo of rows covering the filter support at every level
+    support = pywt.Wavelet(wavelet).dec_len
+    return 2**level,(support-2)*2**(level+1)
+
+def _waveletStats(windows,**kwargs):
+    return {'out':_minMax(_waveletRaw(*w,**kwargs) for w in windows())}
+
+def _waveletApply(R,G,B,I,P,rows=slice(None),stats=None,**kwargs):
+    panImg = _waveletRaw(R,G,B,I,P,rows,**kwargs)
+    return _rescale(panImg,*stats['out'],out=panImg)
+
+def _waveletWhole(R,G,B,I,P,rows=slice(None),**kwargs):
+    # a single window is transformed once and rescaled by its own range
+    panImg = _waveletRaw(R,G,B,I,P,rows,**kwargs)
+    return _rescale(panImg,panImg.max(),panImg.min(),out=panImg)
+
+
+def _broveyStats(windows,weights=None):
+    stats = [None]*4
+    for window in windows():
+        stats = [_minMax([band],s) for band,s in zip(window[:4],stats)]
+
+    return {'bands':stats}
+
+def _broveyApply(R,G,B,I,P,stats,weights=None):
+    panImg = np.empty([I.shape[0],I.shape[1],4],dtype=I.dtype)
+
+    if weights:
+        if type(weights) == str:
+            try:
+                DNF = (P - (weights[3] * I)) / ((weights[0] * R) + (weights[1] * G) + (weights[2] * B))
+
+                panImg[:,:,2] = B * DNF
+                panImg[:,:,1] = G * DNF
+                panImg[:,:,0] = R * DNF
+                panImg[:,:,3] = I * DNF
+            except IndexError:
+                raise IndexError('weights list has wrong number of elements')
+        else:
+            raise TypeError('weights keyword requires a list')
+
+    else:
+        # denominator shared by all bands
+        denom = B + G
+        denom += R
+        denom *= P
+        for b,band in enumerate((R,G,B,I)):
+            np.divide(band,denom,out=panImg[:,:,b])
+            _rescale(panImg[:,:,b],*stats['bands'][b],out=panImg[:,:,b])
+
+    return panImg
+
+
+def _chunks(bands,chunk=CHUNK):
+    # (start, end, (pixels, bands) array) over chunks of pixels of the bands, in their dtype
+    flat = [band.ravel() for band in bands]
+    for i0 in range(0,flat[0].size,chunk):
+        i1 = min(i0+chunk,flat[0].size)
+        stack = np.empty((i1-i0,len(flat)),dtype=flat[0].dtype)
+        for b,band in enumerate(flat):
+            stack[:,b] = band[i0:i1]
+        yield i0,i1,stack
+
+def _pcaFit(windows,n_components=4,sample=None,seed=0):
+    # principal axes from the streamed band means and covariance, with the
+    # sign of each axis fixed so its largest loading is positive. sums are
+    # accumulated in float64 whatever the working dtype. with sample the sums
+    # of a window are estimated from that many randomly drawn pixels
+    rng = np.random.RandomState(seed)
+    n,total,outer = 0,0,0
+    for window in windows():
+        size = window[0].size
+        if sample and sample < size:
+            idx = rng.randint(0,size,int(sample))
+            parts = [(np.column_stack([band.ravel()[idx] for band in window[:4]]),size/float(sample))]
         else:
-            out = ((maxVal-minVal) * (data-minVal)) / (maxVal-minVal)
+            parts = ((stack,1.) for _,_,stack in _chunks(window[:4]))
+
+        n += size
+        for part,weight in parts:
+            part = part.astype(np.float64)
+            total = total + weight*part.sum(axis=0)
+            outer = outer + weight*part.T.dot(part)
+
+    mean = total / n
+    cov = (outer - n*np.outer(mean,mean)) / (n-1)
+    eigval,eigvec = np.linalg.eigh(cov)
+    components = eigvec[:,np.argsort(eigval)[::-1]].T[:n_components]
+    signs = np.sign(components[np.arange(n_components),np.abs(components).argmax(axis=1)])
+    components *= signs[:,np.newaxis]
+
+    return mean,components
+
+def _pcaProject(R,G,B,I,P,mean,components,n_components=4):
+    # replacing the first component by the stretched pan band and projecting
+    # back is, per pixel, (x - mean) M + (pan - pcMin) C0 + mu with M the
+    # projector onto the other kept components, so chunks of pixels are written
+    # straight into the output with no transform matrix. the stretch only
+    # shifts each band by pcMin C0, it is left to the caller as the range of
+    # the first component is gathered in the same pass, returned as (max, min)
+    dtype = R.dtype
+    components = components.astype(dtype)
+    mean = mean.astype(dtype)
+    keep = components[1:n_components]
+    M = keep.T.dot(keep)
+
+    p = P.ravel()
+    pcMax,pcMin = -np.inf,np.inf
+    Xhat = np.empty((P.size,4),dtype=dtype)
+    for i0,i1,stack in _chunks((R,G,B,I)):
+        mu = np.mean(stack, axis=1)
+        stack -= mean
+        pc = stack.dot(components[0])
+        pcMax,pcMin = max(pcMax,pc.max()),min(pcMin,pc.min())
+        np.dot(stack,M,out=Xhat[i0:i1])
+        Xhat[i0:i1] += np.outer(p[i0:i1],components[0])
+        Xhat[i0:i1] += mu[:,np.newaxis]
+
+    return Xhat.reshape([P.shape[0],P.shape[1],Xhat.shape[1]]),(pcMax,pcMin)
+
+def _pcaStats(windows,n_components=4,sample=None):
+    # the output range follows from the band ranges of the unstretched
+    # projection once the range of the first component is known
+    mean,components = _pcaFit(windows,n_components,sample)
+
+    pc = None
+    bandMax,bandMin = np.full(4,-np.inf),np.full(4,np.inf)
+    for w in windows():
+        Xhat,pcRange = _pcaProject(*w,mean=mean,components=components,n_components=n_components)
+        pc = _minMax([np.array(pcRange)],pc)
+        np.maximum(bandMax,Xhat.max(axis=(0,1)),out=bandMax)
+        np.minimum(bandMin,Xhat.min(axis=(0,1)),out=bandMin)
+
+    shift = pc[1]*components[0]
+    return {'mean':mean,'components':components,'pc':pc,
+            'out':((bandMax-shift).max(),(bandMin-shift).min())}
+
+def _pcaApply(R,G,B,I,P,stats,n_components=4,sample=None):
+    panImg,_ = _pcaProject(R,G,B,I,P,stats['mean'],stats['components'],n_components)
+    panImg -= (stats['pc'][1]*stats['components'][0]).astype(panImg.dtype)
+    return _rescale(panImg,*stats['out'],out=panImg)
+
+def _pcaWhole(R,G,B,I,P,n_components=4,sample=None):
+    # a single window is fitted, projected once and rescaled by its own range
+    mean,components = _pcaFit(lambda: iter([(R,G,B,I,P)]),n_components,sample)
+    panImg,pc = _pcaProject(R,G,B,I,P,mean,components,n_components)
+    panImg -= (pc[1]*components[0]).astype(panImg.dtype)
+    return _rescale(panImg,panImg.max(),panImg.min(),out=panImg)
+
+
+# stats pass and per window function of each method with its number of output
+# bands, for methods mixing neighbouring rows the (alignment, halo) of windows
+# and, for methods whose stats need the transform itself, a function that
+# transforms an image processed as one window only once
+METHODS = {
+    'hsv':(_hsvStats,_hsvApply,3,None,None),
+    'wavelet':(_waveletStats,_waveletApply,4,_waveletMargins,_waveletWhole),
+    'brovey':(_broveyStats,_broveyApply,4,None,None),
+    'pca':(_pcaStats,_pcaApply,4,None,_pcaWhole),
+}
+
+WAVELET_RULES = ('substitute','additive','max')
+
+
+def tiled(method,R,G,B,I,P,S=None,budget=512,out=None,dtype=np.float64,**kwargs):
+    '''Function to run a pansharpening method over windows of rows so memory
+    stays within a budget for full scene inputs. Statistics the methods
+    compute over the whole image (rescaling ranges, PCA axes, histogram of P)
+    are gathered in streaming passes over the windows first, so the result
+    matches the whole image result. An image processed as one window is
+    transformed once and rescaled by its own range instead. Each window is interpolated from a haloed
+    slice of the multispectral bands, and methods mixing neighbouring rows
+    (wavelet) get a halo of extra rows that is cropped from their output.
+
+    Args:
+        method (str): one of 'hsv', 'wavelet', 'brovey' or 'pca'
+        R (ndarray): 2-d array representing the red channel of image.
+        G (ndarray): 2-d array representing the green channel of image.
+        B (ndarray): 2-d array representing the blue channel of image.
+        I (ndarray): 2-d array representing the infrared channel of image.
+        P (ndarray): 2-d array representing the panchromatic band of image, can be a np.memmap
+        S (ndarray, optional): template image the histogram of P is matched to
+        budget (float, optional): approximate memory in MB used for window intermediates,
+                                  None to process the image as one window
+        out (ndarray, optional): preallocated (rows,cols,bands) output, e.g. a np.memmap
+        dtype (numpy dtype, optional): working precision, np.float32 halves the memory of the
+                                       intermediates and of the output
+        **kwargs: keyword arguments of the method, e.g. weight for hsv
+
+    Returns:
+        panImg (ndarray): 3-d array of the pan sharpened image
+    '''
+    if method not in METHODS:
+        raise ValueError('method must be one of {}'.format(sorted(METHODS.keys())))
+    statsFunc,applyFunc,nOut,margins,wholeFunc = METHODS[method]
+    align,halo = margins(**kwargs) if margins else (2,0)
+
+    shape = (R.shape[0]*2,R.shape[1]*2)
+    if P.shape != shape:
+        raise ValueError('pan band must be twice the size of the multispectral bands')
+
+    if budget is None:
+        rows = shape[0]
     else:
-        if inverse:
-            out = (maxVal-data) / (maxVal-minVal)
+        # window heights are multiples of the alignment of the method, at least even
+        itemsize = np.dtype(dtype).itemsize
+        rows = int(budget*1024**2 // (shape[1]*BYTES_PER_PIXEL*itemsize/8))
+        rows = min(max(rows - rows%align,align),shape[0])
+    windows = [(r0,min(r0+rows,shape[0])) for r0 in range(0,shape[0],rows)]
+
+    match = _histMatcher(P,S,windows) if S is not None else None
+
+    def _window(r0,r1):
+        e0,e1 = (max(r0-halo,0),min(r1+halo,shape[0])) if halo else (r0,r1)
+        if len(windows) == 1:
+            bands = list(_interp(R,G,B,I,dtype=dtype))
         else:
-            out = (data-minVal) / (maxVal-minVal)
-            
+            bands = [_interpWindow(band,e0,e1,shape,dtype=dtype) for band in (R,G,B,I)]
+        p = np.asarray(P[e0:e1])
+        p = match(p) if match else p
+        bands.append(p.astype(dtype,copy=False))
+        if halo:
+            # rows of the window within the haloed rows
+            bands.append(slice(r0-e0,r1-e0))
+        return bands
+
+    if len(windows) == 1:
+        # a single window is interpolated once and shared by the stats passes and the apply
+        whole = _window(*windows[0])
+        _window = lambda r0,r1: whole
+
+        if wholeFunc is not None:
+            result = wholeFunc(*whole,**kwargs)
+            if out is None:
+                return result
+            out[...] = result
+            return out
+
+    stats = statsFunc(lambda: (_window(*w) for w in windows),**kwargs)
+
+    if out is None:
+        if len(windows) == 1:
+            return applyFunc(*_window(*windows[0]),stats=stats,**kwargs)
+        out = np.empty((shape[0],shape[1],nOut),dtype=dtype)
+    for r0,r1 in windows:
+        out[r0:r1] = applyFunc(*_window(r0,r1),stats=stats,**kwargs)
+
     return out
 
 
 def gramSchmidt():
-    
+
     return
 
 
-def hsv(R,G,B,I,P,weight=0.3,S=None):
+def hsv(R,G,B,I,P,weight=0.3,S=None,dtype=np.float64,out=None):
     '''Function to apply hue-saturation-intensity pansharpening algorithm
-    
+
     Args:
         R (ndarray): 2-d array representing the red channel of image.
         G (ndarray): 2-d array representing the green channel of image.
         B (ndarray): 2-d array representing the blue channel of image.
         I (ndarray): 2-d array representing the infrared channel of image.
         P (ndarray): 2-d array representing the panchromatic band of image.
-        weight (float): Value representing the weight of IR channel in the pan image. 
+        weight (float): Value representing the weight of IR channel in the pan image.
 
     Returns:
         panImg (ndarrayd): 3-d array of the pan sharpened RGB image
     '''
-    if not (S is None):
-        P = utils.hist_match(P,S)
-    
-    R,G,B,I = _interp(R,G,B,I)
-    rgb = np.dstack([R,G,B])
-    hsv = colors.rgb_to_hsv(rgb)
-    
-    data_max, data_min = hsv[:,:,2].max(),hsv[:,:,2].min()
-    intensity = _rescale((P - I*weight),data_max,data_min)
-
-    outHsv = np.dstack([hsv[:,:,0],hsv[:,:,1],intensity])
-
-    panImg = colors.hsv_to_rgb(outHsv)
-    
-    return panImg
+    return tiled('hsv',R,G,B,I,P,S=S,budget=None,weight=weight,dtype=dtype,out=out)
+
+
+def wavelet(R,G,B,I,P,wavelet='haar',level=1,rule='substitute',budget=None,dtype=np.float64,out=None):
+    '''Function to apply wavelet pansharpening algorithm, each band is decomposed
+    in turn and keeps its approximation while the detail coefficients are taken
+    from the panchromatic band following the injection rule. The pan details are
+    decomposed and reconstructed once and shared by all bands
+
+    Args:
+        R (ndarray): 2-d array representing the red channel of image.
+        G (ndarray): 2-d array representing the green channel of image.
+        B (ndarray): 2-d array representing the blue channel of image.
+        I (ndarray): 2-d array representing the infrared channel of image.
+        P (ndarray): 2-d array representing the panchromatic band of image.
+        wavelet (str, optional): name of a discrete wavelet of pywt, e.g. 'db2'
+        default = 'haar'
+        level (int, optional): number of decomposition levels
+        default = 1
+        rule (str, optional): 'substitute' replaces the band details with the pan details,
+                              'additive' adds them and 'max' keeps the larger in magnitude
+        default = 'substitute'
+        budget (float, optional): approximate memory in MB used per window of tiled
+        default = None, the image is processed as one window
+
+    Returns:
+        panImg (ndarray): 3-d array of the pan sharpened RGBI image
+    '''
+    return tiled('wavelet',R,G,B,I,P,budget=budget,dtype=dtype,out=out,
+                 wavelet=wavelet,level=level,rule=rule)
 
 
-def wavelet(R,G,B,I,P):
-    
-    interped = _interp(R,G,B,I)
-    
-    multiSpec = []
-    panCoeffs = pywt.dwt2(P, 'haar')
-    
-    for i in range(len(interped)):
-        wave = pywt.dwt2(interped[i], 'haar')
-        coeffs = (wave[0],panCoeffs[1])
-        multiSpec.append(pywt.idwt2(coeffs, 'haar'))
-    
-    panImg = np.dstack(multiSpec)
-    
-    return _rescale(panImg,panImg.max(),panImg.min())
-    
-
-def brovey(R,G,B,I,P,weights=None,S=None):
+def brovey(R,G,B,I,P,weights=None,S=None,dtype=np.float64,out=None):
     '''Function to apply brovey pansharpening algorithm
-    
+
     Args:
         R (ndarray): 2-d array representing the red channel of image.
         G (ndarray): 2-d array representing the green channel of image.
         B (ndarray): 2-d array representing the blue channel of image.
         I (ndarray): 2-d array representing the infrared channel of image.
         P (ndarray): 2-d array representing the panchromatic band of image.
-        weights (list, ndarray): List representing the weights of channels in 
-                                 the pan image in order or RGBI. 
+        weights (list, ndarray): List representing the weights of channels in
+                                 the pan image in order or RGBI.
 
     Returns:
         panImg (ndarray): 3-d array of the pan sharpened RGB image
     '''
-    if not (S is None):
-        P = utils.hist_match(P,S)
-        
-    R,G,B,I = _interp(R,G,B,I)
-    panImg = np.zeros([I.shape[0],I.shape[1],4])
-    
-    if weights:
-        if type(weights) == str:
-            try:
-                DNF = (P - (weights[3] * I)) / ((weights[0] * R) + (weights[1] * G) + (weights[2] * B))
-
-                panImg[:,:,2] = B * DNF
-                panImg[:,:,1] = G * DNF
-                panImg[:,:,0] = R * DNF
-                panImg[:,:,3] = I * DNF
-            except IndexError:
-                raise IndexError('weights list has wrong number of elements')
-        else:
-            raise TypeError('weights keyword requires a list')
-    
-    else:
-        panImg[:,:,0] = _rescale(R / ((B + G + R) * P),R.max(),R.min())
-        panImg[:,:,1] = _rescale(G / ((B + G + R) * P),G.max(),G.min())
-        panImg[:,:,2] = _rescale(B / ((B + G + R) * P),B.max(),B.min())
-        panImg[:,:,3] = _rescale(I / ((B + G + R) * P),I.max(),I.min())
-    
-    return panImg
+    return tiled('brovey',R,G,B,I,P,S=S,budget=None,weights=weights,dtype=dtype,out=out)
 
 
-def pca(R,G,B,I,P,n_components=4,S=None):
+def pca(R,G,B,I,P,n_components=4,S=None,sample=None,dtype=np.float64,out=None):
     '''Function to apply principal component analysis pansharpening algorithm
-    
+
     Args:
         R (ndarray): 2-d array representing the red channel of image.
         G (ndarray): 2-d array representing the green channel of image.
         B (ndarray): 2-d array representing the blue channel of image.
         I (ndarray): 2-d array representing the infrared channel of image.
         P (ndarray): 2-d array representing the panchromatic band of image.
-        n_components (int): Integer value representing the number of components to solve 
+        n_components (int): Integer value representing the number of components to solve
+        sample (int, optional): number of randomly drawn pixels the principal axes are
+                                fitted on, None to fit on every pixel
 
     Returns:
         panImg (ndarray): 3-d array of the pan sharpened RGB image
-    ''' 
-    if not (S is None):
-        P = utils.hist_match(P,S)
-   
-    R,G,B,I = _interp(R,G,B,I)
-    stack = np.vstack([R.ravel(),G.ravel(),B.ravel(),I.ravel()]).T
-    
-    mu = np.mean(stack, axis=1)
-    
-    pca_ = PCA(n_components=n_components)
-    pca_.fit(stack)
-    
-    transform = pca_.transform(stack)
-    data_min,data_max = transform[:,0].min(),transform[:,0].max()
-    
-    transform[:,0] = _rescale(P.ravel(),data_max,data_min,stretch=True)
-
-    Xhat = np.dot(transform[:,:n_components], pca_.components_[:n_components,:])
-    Xhat += mu[:,np.newaxis]
-    
-    panImg = Xhat.reshape([P.shape[0],P.shape[1],Xhat.shape[1]])
-    
-    return _rescale(panImg,panImg.max(),panImg.min())
-
-    
-if __name__ == "__main__":
-    infile = '/home/ubuntu/hydra/data/VNP09GA_NRT.A2018053.h27v07.001.h5'
-    
-    viirs = io.readViirs(infile)
-    
-    try:
-        pan = hsv(viirs)
-    except:
-        raise RuntimeError('Opps...something went wrong with module')
\ No newline at end of file
+    '''
+    return tiled('pca',R,G,B,I,P,S=S,budget=None,n_components=n_components,sample=sample,
+                 dtype=dtype,out=out)
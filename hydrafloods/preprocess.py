@@ -1,105 +1,417 @@
 
 import os
+import hashlib
 import numpy as np
+from functools import lru_cache
+from collections import OrderedDict
 import xarray as xr
-from scipy import ndimage, interpolate
 from osgeo import gdal,osr
 from pyproj import Proj,transform
-from pyresample import bilinear, geometry, utils
+from pyresample import bilinear, geometry
 
+from . import fetch, utils, qa, reproject
 
-def viirs(infile):
-    tree = '//HDFEOS/GRIDS/VNP_Grid_{}_2D/Data_Fields/'
-    field = 'SurfReflect_{0}{1}_1'
-    base = 'HDF5:"{0}":{1}{2}'
 
-    outEpsg = 3857
-    nd = -999
-
-    # sinuWkt = '''PROJCS["Sphere_Sinusoidal",GEOGCS["GCS_Sphere",DATUM["D_Sphere",SPHEROID["Sphere",6371000.0,0.0]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],PROJECTION["Sinusoidal"],PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],PARAMETER["Central_Meridian",0.0],UNIT["Meter",1.0]]'''
+# VNP09GA subdatasets read by viirs, M bands at 1km and I bands at 500m
+VIIRS_TREE = '//HDFEOS/GRIDS/VNP_Grid_{}_2D/Data_Fields/'
+VIIRS_FIELD = 'SurfReflect_{0}{1}_1'
+VIIRS_BANDS = [[i for i in range(12) if i not in [0,6,9]], [i for i in range(1,4)]]
+VIIRS_RES = ['1km','500m']
+VIIRS_MODE = ['M','I']
 
-    proj = '+proj=sinu +lon_0=0 +x_0=0 +y_0=0 +datum=WGS84 +ellps=WGS84 +a=6371007.181 +b=6371007.181 +units=m +no_defs'
-    outProj = Proj(proj)
-    inProj = Proj(init='epsg:4326')
+# in-memory GDAL filesystem used when outputs go straight to upload
+VSIMEM = '/vsimem/hydrafloods'
 
-    srs = osr.SpatialReference()
-    srs.ImportFromProj4(outProj.definition_string())
 
-    m = [i for i in range(12) if i not in [0,6,9]]
-    i = [i for i in range(1,4)]
-    bands = [m,i]
-    flatBands = [item for sublist in bands for item in sublist]
+def viirsSubdataset(infile,res,field):
+    """Returns the GDAL path of a VNP09GA field in either the original HDF5
+    granule or a subset written by ingest.viirs"""
+    if infile.endswith('.nc'):
+        return 'NETCDF:"{0}":{1}'.format(infile,field)
+    else:
+        return 'HDF5:"{0}":{1}{2}'.format(infile,VIIRS_TREE.format(res),field)
 
-    res = ['1km','500m']
-    mode = ['M','I']
 
-    band = gdal.Open(base.format(infile,tree.format('1km'),field.format('QF',1)))
-    metadata = band.GetMetadata()
-    # print(metadata)
-    cloudQA = _extractBits(band.ReadAsArray(),2,3)
-    hiresCloudQA = ndimage.zoom(cloudQA,2,order=0)
-    band = None
+def _metadataValue(metadata,key,default=None):
+    # hdf5 and netcdf drivers prefix attribute names differently
+    for k in metadata.keys():
+        if k.split('#')[-1].split('/')[-1] == key:
+            return metadata[k]
 
-    band = gdal.Open(base.format(infile,tree.format('1km'),field.format('QF',2)))
-    shadowQA = _extractBits(band.ReadAsArray(),3,3)
-    hiresShadowQA = ndimage.zoom(shadowQA,2,order=0)
+    return default
 
-    qa = ~(hiresCloudQA>0)&(hiresShadowQA<1)
 
-    ringLatitude = metadata['GRingLatitude'].split(' ')[:-1]
-    ringLongitude = metadata['GRingLongitude'].split(' ')[:-1]
+def _outName(infile,suffix,vsimem=False):
+    name,_ = os.path.splitext(infile)
+    if vsimem:
+        name = '/'.join([VSIMEM,os.path.basename(name)])
+
+    return name + suffix
+
+
+def readVsimem(path,unlink=True):
+    """Returns the bytes of an in-memory /vsimem file, freeing it by default"""
+    f = gdal.VSIFOpenL(path,'rb')
+    gdal.VSIFSeekL(f,0,2)
+    size = gdal.VSIFTellL(f)
+    gdal.VSIFSeekL(f,0,0)
+    data = gdal.VSIFReadL(1,size,f)
+    gdal.VSIFCloseL(f)
+
+    if unlink:
+        gdal.Unlink(path)
+
+    return data
+
+
+def writeVsimem(path,data):
+    """Creates an in-memory /vsimem file from bytes, e.g. returned by readVsimem
+    in another process as every process has its own /vsimem"""
+    gdal.FileFromMemBuffer(path,data)
+    return path
+
+
+def _blockRows(band,minRows=256):
+    # rows per block as a multiple of the native block height of the source,
+    # kept even so a block maps onto whole rows of the 1km grid
+    rows = band.GetBlockSize()[1]
+    rows = rows * int(np.ceil(minRows/float(rows)))
+    return rows + rows%2
+
+
+def viirs(infile,blockRows=None,cog=True,compress='DEFLATE',vsimem=False,outEpsg=None,outRes=500):
+    """Function to preprocess a VNP09GA granule (or an ingest.viirs subset)
+    into a 500m Int16 GeoTIFF of the M and I bands plus a clear sky band.
+    The tile is processed in blocks of rows that are read, upsampled and
+    written straight to the output so only one block is held in memory.
+
+    Args:
+        infile (str): path to the VNP09GA granule or subset
+        blockRows (int, optional): number of 500m rows processed at a time
+        default = None, a multiple of the native block height of at least 256 rows
+        cog (bool, optional): write a cloud optimized geotiff, see writeBlocks
+        default = True
+        compress (str, optional): compression of the cloud optimized geotiff
+        default = 'DEFLATE'
+        vsimem (bool, optional): write the output to an in-memory /vsimem file under VSIMEM
+        default = False
+        outEpsg (int, optional): EPSG code to reproject the output to with a cached
+        index map from reproject.indexMap, e.g. 3857
+        default = None, the sinusoidal grid of the input
+        outRes (float, optional): resolution of the reprojected output
+        default = 500
+
+    Returns:
+        outName (str): path to the preprocessed GeoTIFF
+    """
+    nd = -999
 
-    ll,ul,ur,lr = [transform(inProj,outProj,float(ringLongitude[i]),float(ringLatitude[i])) for i in range(len(ringLatitude))]
-    iniX,iniY = ul[0],ul[1]
-    print(ll,ul,ur,lr)
+    bands = VIIRS_BANDS
+    res = VIIRS_RES
+    mode = VIIRS_MODE
 
-    bandNames = ['{0}{1}'.format(mode[i],bands[i][j]) \
-                    for i in range(len(res)) \
-                    for j in range(len(bands[i]))
-                ]
+    qf1 = gdal.Open(viirsSubdataset(infile,'1km',VIIRS_FIELD.format('QF',1)))
+    qf2 = gdal.Open(viirsSubdataset(infile,'1km',VIIRS_FIELD.format('QF',2)))
+    metadata = qf1.GetMetadata()
 
-    subdata = [[infile,res[i],mode[i],bands[i][j]] \
+    subdata = [[res[i],mode[i],bands[i][j]] \
                     for i in range(len(res)) \
                     for j in range(len(bands[i]))
               ]
 
-    data = np.zeros([qa.shape[0],qa.shape[1],len(subdata)+1])
+    sources = [gdal.Open(viirsSubdataset(infile,r,VIIRS_FIELD.format(m,b))) for r,m,b in subdata]
+
+    # outputs are on the 500m grid, twice the size of the 1km qa grid
+    yDim, xDim = qf1.RasterYSize*2, qf1.RasterXSize*2
+
+    # the tile grid is fixed so the exact georeferencing follows from h/v
+    # and the offset of the window when the input is an ingested subset
+    h = int(_metadataValue(metadata,'HorizontalTileNumber'))
+    v = int(_metadataValue(metadata,'VerticalTileNumber'))
+    xoff = int(_metadataValue(metadata,'xoff',0))
+    yoff = int(_metadataValue(metadata,'yoff',0))
+    tileSize = int(_metadataValue(metadata,'tileSize',yDim))
+
+    x0,res,_,y0,_,_ = fetch.tileGeotransform(h,v,tileSize)
+    gt = (x0 + xoff*res,res,0,y0 - yoff*res,0,-res)
+
+    outName = _outName(infile,'.TIF',vsimem)
+
+    nBands = len(subdata)+1
+
+    if blockRows is None:
+        blockRows = _blockRows(sources[-1].GetRasterBand(1))
+    blockRows += blockRows%2
+
+    # upsampled 1km blocks are written into one reused buffer, each block
+    # is written out before the next one is produced
+    buf = np.empty((blockRows,xDim),dtype=np.int16)
+
+    def _blocks():
+        for y in range(0,yDim,blockRows):
+            ySize = min(blockRows,yDim-y)
+            y1km, ySize1km = y//2, ySize//2
+
+            clear = qa.decode({'QF1':qf1.ReadAsArray(0,y1km,xDim//2,ySize1km),
+                               'QF2':qf2.ReadAsArray(0,y1km,xDim//2,ySize1km)},'viirs_clear')
+            yield nBands, 0, y, utils.upsample(clear,2,out=buf[:ySize])
+
+            for i,(r,m,b) in enumerate(subdata):
+                if r == '1km':
+                    block = utils.upsample(sources[i].ReadAsArray(0,y1km,xDim//2,ySize1km),2,out=buf[:ySize])
+                else:
+                    block = sources[i].ReadAsArray(0,y,xDim,ySize).astype(np.int16)
+
+                block[block<0] = nd
+                yield i+1, 0, y, block
+
+    def _band(i):
+        # whole 500m band, 1-based with the clear sky band last
+        if i == nBands:
+            clear = qa.decode({'QF1':qf1.ReadAsArray(),'QF2':qf2.ReadAsArray()},'viirs_clear')
+            return utils.upsample(clear.astype(np.int16),2)
+
+        r,m,b = subdata[i-1]
+        data = sources[i-1].ReadAsArray().astype(np.int16)
+        if r == '1km':
+            data = utils.upsample(data,2)
+        data[data<0] = nd
+
+        return data
+
+    def _reprojected(idx):
+        # one band in memory at a time, gathered into the output in row blocks
+        for i in range(1,nBands+1):
+            padded = reproject.pad(_band(i),nd)
+            for y in range(0,idx.shape[0],blockRows):
+                yield i, 0, y, reproject.gather(padded,idx[y:y+blockRows])
+
+    # nearest neighbour overviews keep the clear sky band binary
+    if outEpsg is None:
+        writeBlocks(outName,_blocks(),xDim,yDim,nBands,gt,fetch.SINUSOIDAL,noData=nd,
+                    cog=cog,compress=compress,resampling='NEAREST')
+    else:
+        idx,outGt = reproject.indexMap(h,v,(xoff,yoff,xDim,yDim),epsg=outEpsg,
+                                       res=outRes,nPixels=tileSize)
+        writeBlocks(outName,_reprojected(idx),idx.shape[1],idx.shape[0],nBands,outGt,outEpsg,
+                    noData=nd,cog=cog,compress=compress,resampling='NEAREST')
 
-    for i,s in enumerate(subdata):
-        infile, r, m, b = s
+    return outName
 
-        subdataset = base.format(infile,tree.format(r),field.format(m,b))
+@lru_cache(maxsize=4)
+def _mercatorGrid(res):
+    # global pseudo-mercator grid coordinates the ATMS swaths are snapped to
+    outProj = Proj(init='epsg:3857')
+    inProj = Proj(init='epsg:4326')
+    minx,miny = transform(inProj,outProj,-180,-86)
+    maxx,maxy = transform(inProj,outProj,180,86)
 
-        band = gdal.Open(subdataset)
-        if m == 'M':
-            data = ndimage.zoom(band.ReadAsArray(),2,order=0)
+    eastings = np.arange(round(minx),round(maxx),res)
+    northings = np.arange(round(miny),round(maxy),res)
 
+    return eastings, northings
+
+
+@lru_cache(maxsize=64)
+def mercatorArea(xmin,ymin,xmax,ymax,nx,ny):
+    """Returns the pseudo-mercator AreaDefinition of a grid window, area
+    definitions are cached so swaths falling on the same window share one"""
+    return geometry.AreaDefinition('mercator',
+                                   'WGS 84 / Pseudo-Mercator - Projected',
+                                   'mercator',
+                                   {'x_0': '0.0', 'y_0': '0.0', 'lat_ts': '0.00',
+                                    'lon_0': '0.00', 'proj': 'merc','k':'1.0',
+                                    'datum':'WGS84','ellps': 'WGS84',
+                                    'a':'6378137','b':'6378137'},
+                                   nx, ny,
+                                   [xmin, ymin, xmax, ymax])
+
+
+def _fingerprint(lons,lats,area,*params):
+    sha = hashlib.sha1()
+    for arr in (lons,lats):
+        sha.update(np.ascontiguousarray(arr,dtype=np.float64).tobytes())
+    sha.update(repr((area.shape,tuple(area.area_extent))+params).encode())
+
+    return sha.hexdigest()
+
+
+# neighbour info of the most recently gridded swaths kept in memory
+_bilinearCache = OrderedDict()
+
+
+def bilinearInfo(lons,lats,area,radius,neighbours=32,epsilon=0.1,nprocs=1,cachedir=None,maxItems=8):
+    """Returns the bilinear neighbour info (t, s, input index, index array) of
+    a swath onto an area. Info is cached in memory, and optionally on disk,
+    keyed by a fingerprint of the swath geolocation and target area, so every
+    variable of a granule skips the KD-tree search. Swaths never repeat exactly,
+    so the disk cache only pays off when the same granules are gridded again.
+
+    Args:
+        lons (ndarray): swath longitudes
+        lats (ndarray): swath latitudes
+        area (geometry.AreaDefinition): target area
+        radius (float): cut-off distance in meters
+        neighbours (int, optional): number of neighbours considered per grid point
+        default = 32
+        epsilon (float, optional): allowed uncertainty in meters of the neighbour search
+        default = 0.1
+        nprocs (int, optional): number of processes used for the neighbour search
+        default = 1
+        cachedir (str, optional): directory of an on disk cache, e.g. utils.cache_dir('bilinear')
+        default = None, info is only cached in memory
+        maxItems (int, optional): number of swaths kept in memory
+        default = 8
+
+    Returns:
+        info (tuple): arguments to bilinear.get_sample_from_bil_info
+    """
+    key = _fingerprint(lons,lats,area,radius,neighbours,epsilon)
+    if key in _bilinearCache:
+        _bilinearCache.move_to_end(key)
+        return _bilinearCache[key]
+
+    cached = os.path.join(cachedir,key+'.npz') if cachedir else None
+
+    if cached and os.path.exists(cached):
+        with np.load(cached) as npz:
+            info = (npz['t'],npz['s'],npz['inputIdxs'],npz['idxArr'])
+    else:
+        swath_def = geometry.SwathDefinition(lons=lons, lats=lats)
+        info = bilinear.get_bil_info(swath_def,area,radius=radius,neighbours=neighbours,
+                                     nprocs=nprocs,reduce_data=True,segments=None,
+                                     epsilon=epsilon)
+        if cached:
+            # written under a temporary name so concurrent workers never read a partial file
+            tmp = '{0}.{1}.npz'.format(cached[:-4],os.getpid())
+            np.savez(tmp,t=info[0],s=info[1],inputIdxs=info[2],idxArr=info[3])
+            os.replace(tmp,cached)
+
+    _bilinearCache[key] = info
+    if len(_bilinearCache) > maxItems:
+        _bilinearCache.popitem(last=False)
+
+    return info
+
+
+def bilinearResample(data,info,shape,fill_value=None):
+    """Resamples swath data with precomputed neighbour info from bilinearInfo
+
+    Args:
+        data (ndarray): swath data with the shape of the swath geolocation
+        info (tuple): neighbour info from bilinearInfo
+        shape (tuple): (rows,cols) of the target area
+        fill_value (float, optional): value of grid points without data
+        default = None, nan
+
+    Returns:
+        result (ndarray): gridded data
+    """
+    t,s,inputIdxs,idxArr = info
+    result = bilinear.get_sample_from_bil_info(np.ravel(data),t,s,inputIdxs,idxArr,
+                                               output_shape=shape)
+    if fill_value is not None:
+        result[np.isnan(result)] = fill_value
+
+    return result
+
+
+def bucketGrid(data,x,y,gt,shape,radius=None,fill_value=None):
+    """Grids swath samples by averaging all samples that fall into each grid
+    cell. With a radius every sample is also spread onto the cells whose
+    centers lie within radius, weighted by a gaussian footprint with a sigma of
+    radius/2, which fills the gaps between footprints at the swath edges.
+
+    Args:
+        data (ndarray): swath sample values, nan samples are ignored
+        x (ndarray): sample x coordinates in the grid projection
+        y (ndarray): sample y coordinates in the grid projection
+        gt (tuple): GDAL geotransform of the grid
+        shape (tuple): (rows,cols) of the grid
+        radius (float, optional): gaussian footprint cut-off distance in grid units
+        default = None, plain drop-in-bucket averaging
+        fill_value (float, optional): value of grid cells without samples
+        default = None, nan
+
+    Returns:
+        result (ndarray): gridded data
+    """
+    data,x,y = np.ravel(data),np.ravel(x),np.ravel(y)
+    valid = np.isfinite(data) & np.isfinite(x) & np.isfinite(y)
+    data,x,y = data[valid],x[valid],y[valid]
+
+    nRows,nCols = shape
+    n = nRows * nCols
+
+    # fractional pixel coordinates of the samples
+    col = (x - gt[0]) / gt[1]
+    row = (y - gt[3]) / gt[5]
+    c0 = np.floor(col).astype(np.int64)
+    r0 = np.floor(row).astype(np.int64)
+
+    if radius is None:
+        offsets = [(0,0)]
+    else:
+        k = int(np.ceil(radius / min(abs(gt[1]),abs(gt[5]))))
+        # neighbouring cells that lie entirely outside the radius are skipped
+        offsets = [(i,j) for i in range(-k,k+1) for j in range(-k,k+1)
+                   if (max(abs(i)-1,0)*gt[5])**2 + (max(abs(j)-1,0)*gt[1])**2 <= radius**2]
+        sigma2 = 2 * (radius / 2.)**2
+
+    sums = np.zeros(n)
+    weights = np.zeros(n)
+    for dr,dc in offsets:
+        r,c = r0 + dr, c0 + dc
+        inside = (r >= 0) & (r < nRows) & (c >= 0) & (c < nCols)
+        if radius is None:
+            w = None
         else:
-            sd = np.array(band.ReadAsArray())
-        band = None
-
-        sd[np.where(sd<0)] = nd
-
-        data[:,:,i] = sd
+            d2 = ((c + 0.5 - col) * gt[1])**2 + ((r + 0.5 - row) * gt[5])**2
+            inside &= d2 <= radius**2
+            w = np.exp(-d2[inside] / sigma2)
+
+        idx = r[inside] * nCols + c[inside]
+        v = data[inside]
+        sums += np.bincount(idx,weights=v if w is None else v * w,minlength=n)
+        weights += np.bincount(idx,weights=w,minlength=n)
+
+    result = np.full(n,np.nan if fill_value is None else fill_value,dtype=np.float64)
+    hit = weights > 0
+    result[hit] = sums[hit] / weights[hit]
+
+    return result.reshape(shape)
+
+
+def atms(infile,gridding_radius=25000,nprocs=1,method='bilinear',cog=True,compress='DEFLATE',vsimem=False,
+         cachedir=None):
+    """Grids the ATMS land fraction of a granule into a water fraction geotiff
+
+    Args:
+        infile (str): path to the ATMS granule
+        gridding_radius (float, optional): search/footprint radius in meters
+        default = 25000
+        nprocs (int, optional): number of processes used for the bilinear neighbour search
+        default = 1
+        method (str, optional): gridding engine, one of 'bilinear' (pyresample
+            bilinear interpolation), 'bucket' (mean of the samples within each
+            cell) or 'gaussian' (samples spread over gridding_radius with gaussian weights)
+        default = 'bilinear'
+        cog (bool, optional): write a cloud optimized geotiff, see writeBlocks
+        default = True
+        compress (str, optional): compression of the cloud optimized geotiff
+        default = 'DEFLATE'
+        vsimem (bool, optional): write the output to an in-memory /vsimem file under VSIMEM
+        default = False
+        cachedir (str, optional): directory of an on disk cache of the bilinear neighbour info,
+            for granules that are gridded repeatedly, see bilinearInfo
+        default = None
+
+    Returns:
+        outName (str): path to the output geotiff
+    """
+    if method not in ('bilinear','bucket','gaussian'):
+        raise ValueError("method keyword must be one of 'bilinear', 'bucket' or 'gaussian'")
 
-    data[:,:,-1] = qa
-
-    res = float(metadata['CharacteristicBinSize500M'])
-    yskew = math.sin(_getSkew(ur,ul)) * res
-    xskew = math.cos(_getSkew(ul,ll)) * res
-    print(xskew,yskew)
-    yDim, xDim = qa.shape
-    gt = (10007554.677,res,0,2223901.039333,0,-res)
-    print(gt)
-
-    name,_ = os.path.splitext(infile)
-    outName = name + '.TIF'
-
-    writeGeotiff(outName,data,gt,outEpsg,noData=nd)
-
-    return outName
-
-def atms(infile,gridding_radius=25000,):
     ds = xr.open_dataset(infile)
 
     outEpsg = 3857
@@ -111,82 +423,228 @@ def atms(infile,gridding_radius=25000,):
     lons,lats = ds.lon.values,ds.lat.values
 
     xx,yy = transform(inProj,outProj,lons,lats)
-    minx,miny = transform(inProj,outProj,-180,-86)
-    maxx,maxy = transform(inProj,outProj,180,86)
     res = 16000
 
-    eastings = np.arange(round(minx),round(maxx),res)
-    northings = np.arange(round(miny),round(maxy),res)
+    eastings,northings = _mercatorGrid(res)
 
     ee = eastings[np.where((eastings>xx.min()) & (eastings<xx.max()))]
     nn = northings[np.where((northings>yy.min()) & (northings<yy.max()))]
 
-    swath_def = geometry.SwathDefinition(lons=lons, lats=lats)
-    area_def = geometry.AreaDefinition('mercator',
-                                       'WGS 84 / Pseudo-Mercator - Projected',
-                                       'mercator',
-                                       {'x_0': '0.0', 'y_0': '0.0', 'lat_ts': '0.00',
-                                        'lon_0': '0.00', 'proj': 'merc','k':'1.0',
-                                        'datum':'WGS84','ellps': 'WGS84',
-                                        'a':'6378137','b':'6378137'},
-                                       ee.size, nn.size,
-                                       [ee.min(), nn.min(),
-                                        ee.max(), nn.max()])
-
-    data = None
-
-    # TODO: dynamically estimate sigama based on beam footprints
-    eps = 0.1
-
-    result = bilinear.resample_bilinear(ds.land_frac.where(ds['sat_zen']<50).values,
-                                        swath_def,area_def,radius=gridding_radius,
-                                        neighbours=32,nprocs=1, fill_value=nd,
-                                        reduce_data=True, segments=None,
-                                        epsilon=eps)
+    gt = (ee.min(),res,0,nn.max(),0,-res)
+    landFrac = ds.land_frac.where(ds['sat_zen']<50).values
 
-    result[np.where(result>=0)] = np.abs(result[np.where(result>=0)] - 1) * 10000
+    if method == 'bilinear':
+        area_def = mercatorArea(ee.min(), nn.min(), ee.max(), nn.max(), ee.size, nn.size)
 
-    name,_ = os.path.splitext(infile)
-    outName = name + '_waterfrac.TIF'
+        # TODO: dynamically estimate sigama based on beam footprints
+        eps = 0.1
 
-    gt = (ee.min(),res,0,nn.max(),0,-res)
+        info = bilinearInfo(lons,lats,area_def,gridding_radius,neighbours=32,
+                            epsilon=eps,nprocs=nprocs,cachedir=cachedir)
+
+        result = bilinearResample(landFrac,info,area_def.shape,fill_value=nd)
+    else:
+        radius = gridding_radius if method == 'gaussian' else None
+        result = bucketGrid(landFrac,xx,yy,gt,(nn.size,ee.size),radius=radius,fill_value=nd)
+
+    result[np.where(result>=0)] = np.abs(result[np.where(result>=0)] - 1) * 10000
+
+    outName = _outName(infile,'_waterfrac.TIF',vsimem)
 
-    writeGeotiff(outName,result,gt,outEpsg,noData=nd)
+    writeGeotiff(outName,result,gt,outEpsg,noData=nd,cog=cog,compress=compress,resampling='AVERAGE')
 
     return outName
 
-def writeGeotiff(outName,data,gt,epsg,noData=None):
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(epsg)
 
-    if len(data.shape) == 3:
-        yDim,xDim = data.shape[:2]
-        nBands = data.shape[2]
+def atmsMosaic(files,date,outdir=None,noData=-999):
+    """Composites a day of gridded ATMS granules into a single two band
+    geotiff of the per cell mean water fraction and the number of granules
+    observing the cell, so a day is uploaded and ingested as one image. All
+    inputs are on the global grid of atms so they are merged by pixel offsets.
+
+    Args:
+        files (list): water fraction geotiffs written by atms
+        date (datetime.datetime): day of the granules, used in the output name
+        outdir (str, optional): directory of the mosaic
+        default = None, the directory of the first file
+        noData (int, optional): no data value of the inputs and the mosaic
+        default = -999
+
+    Returns:
+        outName (str): path to the mosaic, None if there are no files
+    """
+    if len(files) == 0:
+        return None
+
+    sources = [gdal.Open(f) for f in files]
+    gts = [src.GetGeoTransform() for src in sources]
+    res = gts[0][1]
+
+    # union of the granule extents on the shared grid
+    xmin = min(gt[0] for gt in gts)
+    ymax = max(gt[3] for gt in gts)
+    xmax = max(gt[0] + src.RasterXSize*res for gt,src in zip(gts,sources))
+    ymin = min(gt[3] - src.RasterYSize*res for gt,src in zip(gts,sources))
+    xDim = int(round((xmax-xmin)/res))
+    yDim = int(round((ymax-ymin)/res))
+
+    total = np.zeros((yDim,xDim),dtype=np.float32)
+    count = np.zeros((yDim,xDim),dtype=np.int16)
+
+    for src,gt in zip(sources,gts):
+        xoff = int(round((gt[0]-xmin)/res))
+        yoff = int(round((ymax-gt[3])/res))
+        data = src.GetRasterBand(1).ReadAsArray()
+        valid = data != noData
+
+        window = (slice(yoff,yoff+src.RasterYSize),slice(xoff,xoff+src.RasterXSize))
+        total[window][valid] += data[valid]
+        count[window] += valid
+
+    mean = np.full((yDim,xDim),noData,dtype=np.int16)
+    observed = count > 0
+    mean[observed] = np.round(total[observed] / count[observed])
+
+    if outdir is None:
+        outdir = os.path.dirname(files[0])
+    # named like the granules so the time is the fourth '.' separated field
+    outName = os.path.join(outdir,'SNDR.SNPP.ATMS.{0}.daily_waterfrac.TIF'.format(date.strftime('%Y%m%dT0000')))
+
+    writeGeotiff(outName,np.dstack([mean,count]),(xmin,res,0,ymax,0,-res),
+                 sources[0].GetProjection(),noData=noData,resampling='AVERAGE')
 
-    elif len(data.shape) == 2:
-        yDim,xDim = data.shape
-        nBands = 1
+    return outName
+
+def _createGeotiff(outName,xDim,yDim,nBands,gt,epsg,noData=None,dtype=gdal.GDT_Int16,options=None):
+    srs = osr.SpatialReference()
+    if isinstance(epsg,int):
+        srs.ImportFromEPSG(epsg)
     else:
-        raise
+        # projection given as a proj4/wkt definition, e.g. the sinusoidal grid
+        srs.SetFromUserInput(epsg)
 
     driver = gdal.GetDriverByName('GTiff')
 
-    outDs = driver.Create(outName,xDim,yDim,nBands,gdal.GDT_Int16)
+    outDs = driver.Create(outName,xDim,yDim,nBands,dtype,options=options or [])
     outDs.SetGeoTransform(gt)
-    # set to something that is not user defined
     outDs.SetProjection(srs.ExportToWkt())
 
-    for b in range(nBands):
-        band = outDs.GetRasterBand(b+1)
-        if noData:
-            band.SetNoDataValue(-999)
-        if nBands > 1:
-            band.WriteArray(data[:,:,b])
-        else:
-            band.WriteArray(data)
+    if noData is not None:
+        for b in range(nBands):
+            outDs.GetRasterBand(b+1).SetNoDataValue(noData)
 
-        band = None
+    return outDs
 
-    outDs.FlushCache()
+
+def _predictor(dtype):
+    # horizontal differencing for integers, floating point predictor for floats
+    return 3 if dtype in (gdal.GDT_Float32,gdal.GDT_Float64) else 2
+
+
+def _translateCog(src,outName,compress,blockSize,resampling):
+    options = ['COMPRESS={}'.format(compress),'BIGTIFF=IF_SAFER','NUM_THREADS=ALL_CPUS']
+    dtype = src.GetRasterBand(1).DataType
+
+    driver = gdal.GetDriverByName('COG')
+    if driver is not None:
+        options += ['PREDICTOR=YES','BLOCKSIZE={}'.format(blockSize),
+                    'RESAMPLING={}'.format(resampling)]
+    else:
+        # GDAL < 3.1 has no COG driver, overviews are built on the staging file and
+        # copied ahead of the full resolution data which gives the same layout
+        # levels are added until the smallest one fits in a single block, as the COG driver does
+        size = max(src.RasterXSize,src.RasterYSize)
+        factors = []
+        f = 1
+        while int(np.ceil(size/float(f))) > blockSize:
+            f *= 2
+            factors.append(f)
+        if factors:
+            src.BuildOverviews(resampling,factors)
+
+        driver = gdal.GetDriverByName('GTiff')
+        options += ['TILED=YES','COPY_SRC_OVERVIEWS=YES','PREDICTOR={}'.format(_predictor(dtype)),
+                    'BLOCKXSIZE={}'.format(blockSize),'BLOCKYSIZE={}'.format(blockSize)]
+
+    outDs = driver.CreateCopy(outName,src,options=options)
+    outDs = None
 
     return
+
+
+def writeBlocks(outName,blocks,xDim,yDim,nBands,gt,epsg,noData=None,dtype=gdal.GDT_Int16,
+                cog=True,compress='DEFLATE',blockSize=512,resampling='NEAREST'):
+    """Writes a geotiff from an iterator of blocks so the full raster never has
+    to be held in memory. By default the output is a cloud optimized geotiff:
+    internally tiled, compressed with a predictor and with overviews. Blocks are
+    staged in a tiled geotiff next to the output that the COG is copied from.
+
+    Args:
+        outName (str): path of the output geotiff
+        blocks (iterable): (band,xoff,yoff,data) tuples, band is 1-based and data a 2-d array
+        xDim (int): number of columns
+        yDim (int): number of rows
+        nBands (int): number of bands
+        gt (tuple): GDAL geotransform
+        epsg (int | str): EPSG code or proj4/wkt definition of the projection
+        noData (int, optional): no data value of all bands
+        default = None
+        dtype (int, optional): GDAL data type
+        default = gdal.GDT_Int16
+        cog (bool, optional): write a cloud optimized geotiff, otherwise a plain striped geotiff
+        default = True
+        compress (str, optional): COG compression, e.g. 'DEFLATE', 'ZSTD' or 'LZW'
+        default = 'DEFLATE'
+        blockSize (int, optional): COG tile size in pixels
+        default = 512
+        resampling (str, optional): resampling method of the overviews, e.g. 'NEAREST' or 'AVERAGE'
+        default = 'NEAREST'
+
+    Returns:
+        outName (str): path of the output geotiff
+    """
+    if cog:
+        name,_ = os.path.splitext(outName)
+        stageName = name + '_staging.TIF'
+        options = ['TILED=YES','BLOCKXSIZE={}'.format(blockSize),
+                   'BLOCKYSIZE={}'.format(blockSize),'BIGTIFF=IF_SAFER']
+    else:
+        stageName = outName
+        options = None
+
+    outDs = _createGeotiff(stageName,xDim,yDim,nBands,gt,epsg,noData=noData,dtype=dtype,options=options)
+    outBands = [outDs.GetRasterBand(i+1) for i in range(nBands)]
+
+    for band,xoff,yoff,data in blocks:
+        outBands[band-1].WriteArray(data,xoff,yoff)
+
+    outBands = None
+    outDs.FlushCache()
+
+    if cog:
+        _translateCog(outDs,outName,compress,blockSize,resampling)
+        outDs = None
+        gdal.GetDriverByName('GTiff').Delete(stageName)
+
+    outDs = None
+
+    return outName
+
+
+def writeGeotiff(outName,data,gt,epsg,noData=None,dtype=gdal.GDT_Int16,**kwargs):
+    """Writes a (rows,cols) or (rows,cols,bands) array to a geotiff, keywords
+    are passed to writeBlocks, e.g. cog=False for a plain geotiff"""
+    if len(data.shape) == 3:
+        yDim,xDim = data.shape[:2]
+        nBands = data.shape[2]
+
+    elif len(data.shape) == 2:
+        yDim,xDim = data.shape
+        nBands = 1
+        data = data[:,:,np.newaxis]
+    else:
+        raise ValueError('data must be a 2 or 3 dimensional array')
+
+    blocks = ((b+1,0,0,data[:,:,b]) for b in range(nBands))
+
+    return writeBlocks(outName,blocks,xDim,yDim,nBands,gt,epsg,noData=noData,dtype=dtype,**kwargs)
@@ -1,8 +1,9 @@
 from __future__ import absolute_import
 import os
 import ee
+from functools import partial
 from ee.ee_exception import EEException
-from . import geeutils, downscale, fetch, preprocess, utils
+from . import geeutils, downscale, fetch, ingest, preprocess, utils, qa
 
 
 INITIME = ee.Date.fromYMD(1970,1,1)
@@ -14,6 +15,23 @@ BANDREMAP = ee.Dictionary({
   'new': ee.List(['blue','green','red','nir','swir1','swir2','time'])
 })
 
+def _inMemory(func,infile):
+    # every process has its own /vsimem, rasters made by pool workers are
+    # handed back as bytes and recreated in memory by the parent
+    outName = func(infile)
+    return outName, preprocess.readVsimem(outName)
+
+
+def _pooled(func,files,workers,max_memory,inMemory):
+    if inMemory:
+        results = utils.pool_map(partial(_inMemory,partial(func,vsimem=True)),files,
+                                 workers=workers,max_memory=max_memory)
+        return [preprocess.writeVsimem(*r) for r in results if r is not None]
+    else:
+        results = utils.pool_map(func,files,workers=workers,max_memory=max_memory)
+        return [f for f in results if f is not None]
+
+
 class hfCollection(object):
     def __init__(self,region,time_start,time_end,collectionid=''):
         # TODO: add exceptions to check datatypes
@@ -62,9 +80,21 @@ class Atms(hfCollection):
         return
 
 
-    def extract(self,date,region,outdir='./',creds=None,gridding_radius=50000):
-        files = fetch.atms(date,region,outdir,creds)
-        geotiffs = list(map(lambda x: preprocess.atms(x,gridding_radius), files))
+    def extract(self,date,region,outdir='./',creds=None,gridding_radius=50000,granuleCache=None,
+                nprocs=1,method='bilinear',workers=None,max_memory=None,mosaic=True,inMemory=False):
+        files = fetch.atms(date,region,outdir,creds,granuleCache=granuleCache)
+        # granules are gridded on a process pool, failed granules are left out
+        func = partial(preprocess.atms,gridding_radius=gridding_radius,nprocs=nprocs,method=method)
+        geotiffs = _pooled(func,files,workers,max_memory,inMemory)
+
+        if mosaic and geotiffs:
+            # one daily mean/count image is uploaded instead of every granule
+            mosaicFile = preprocess.atmsMosaic(geotiffs,date,preprocess.VSIMEM if inMemory else outdir)
+            if inMemory:
+                for f in geotiffs:
+                    preprocess.gdal.Unlink(f)
+            geotiffs = [mosaicFile]
+
         return geotiffs
 
 
@@ -93,7 +123,8 @@ class Atms(hfCollection):
             return downscale.bathtub(inImage,handErr,permanent)
 
 
-        inImage = self.collection.mean().divide(10000)
+        # first band is the water fraction of both granule images and daily mosaics
+        inImage = self.collection.select([0]).mean().divide(10000)
         if probablistic:
             iters = ee.List.sequence(0,nIters-1)
 
@@ -122,20 +153,19 @@ class Viirs(hfCollection):
 
     def _qaMask(self,img):
         viewing = img.select('SensorZenith').abs().multiply(0.01).lt(45)
-        clouds = geeutils.extractBits(img.select('QF1'),2,3,'cloud_qa').lte(2)
-        shadows = geeutils.extractBits(img.select('QF2'),3,3,'shadow_qa').eq(0)
-        aerosols = geeutils.extractBits(img.select('QF2'),4,4,'aerosol_qa').eq(0)
-        snows = geeutils.extractBits(img.select('QF2'),5,5,'snow_qa').eq(0)
-        mask = clouds.And(shadows).And(snows).And(viewing)
+        mask = qa.eeMask(img,'viirs').And(viewing)
         t = ee.Date(img.get('system:time_start'))
         nDays = t.difference(INITIME,'day')
         time = ee.Image(nDays).int16().rename('time')
         return img.updateMask(mask).addBands(time)
 
 
-    def extract(self,date,region,outdir='./',creds=None):
-
-        return
+    def extract(self,date,region,outdir='./',creds=None,workers=None,max_memory=None,granuleCache=None,inMemory=False,
+                keepOriginal=True):
+        tiles = fetch.findTiles(region)
+        files = fetch.viirs_many(date,tiles,outdir,creds,product='VNP09GA',granuleCache=granuleCache)
+        subsets = ingest.granules(files,region,sensor='viirs',keepOriginal=keepOriginal)
+        return _pooled(preprocess.viirs,subsets,workers,max_memory,inMemory)
 
     def load(self,files,gcsBucket='',eeAsset=''):
 
@@ -183,20 +213,18 @@ class Modis(hfCollection):
 
     def _qaMask(self,img):
         viewing = img.select('SensorZenith').abs().multiply(0.01).lt(45)
-        clouds = geeutils.extractBits(img.select('state_1km'),10,10,'cloud_qa').neq(1)
-        shadows = geeutils.extractBits(img.select('state_1km'),2,2,'shadow_qa').eq(0)
-        aerosols = geeutils.extractBits(img.select('state_1km'),6,7,'aerosol_qa').neq(0)
-        snows = geeutils.extractBits(img.select('state_1km'),15,15,'snow_qa').eq(0)
-        mask = clouds.And(shadows).And(snows).And(viewing)
+        mask = qa.eeMask(img,'modis').And(viewing)
         t = ee.Date(img.get('system:time_start'))
         nDays = t.difference(INITIME,'day')
         time = ee.Image(nDays).int16().rename('time')
         return img.updateMask(mask).addBands(time)
 
 
-    def extract(self,date,region,outdir='./',creds=None):
-
-        return
+    def extract(self,date,region,outdir='./',creds=None,granuleCache=None,keepOriginal=True):
+        # there is no local MODIS preprocessing yet, granules are subset to the region only
+        tiles = fetch.findTiles(region)
+        files = fetch.modis_many(date,tiles,outdir,creds,product='MOD09GA',granuleCache=granuleCache)
+        return ingest.granules(files,region,sensor='modis',keepOriginal=keepOriginal)
 
     def load(self,files,gcsBucket='',eeAsset=''):
 
@@ -242,9 +270,7 @@ class Landsat(hfCollection):
         return
 
     def _qaMask(self,img):
-        qaCloud = geeutils.extractBits(img.select('pixel_qa'),5,5,'qa').neq(1)
-        qaShadow = geeutils.extractBits(img.select('pixel_qa'),3,3,'qa').neq(1)
-        mask = qaCloud.And(qaShadow)
+        mask = qa.eeMask(img,'landsat')
         t = ee.Date(img.get('system:time_start'))
         nDays = t.difference(INITIME,'day')
         time = ee.Image(nDays).int16().rename('time')
@@ -264,8 +290,7 @@ class Sentinel2(hfCollection):
         return
 
     def _qaMask(self,img):
-        sclImg = img.select('SCL') # Scene Classification Map
-        mask = sclImg.gte(4).And(sclImg.lte(6))
+        mask = qa.eeMask(img,'sentinel2') # Scene Classification Map
         t = ee.Date(img.get('system:time_start'))
         nDays = t.difference(INITIME,'day')
         time = ee.Image(nDays).int16().rename('time')
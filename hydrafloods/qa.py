@@ -0,0 +1,140 @@
+from __future__ import absolute_import
+import ee
+import numpy as np
+from functools import lru_cache
+from collections import namedtuple
+
+# a qa flag is the value of bits start through end (inclusive) of a qa word,
+# a pixel is clear for that flag when the value is one of the clear values
+Flag = namedtuple('Flag',['name','start','end','clear'])
+
+# qa word layouts per sensor as {band name: flags}, a pixel is clear when all flags are
+LAYOUTS = {
+    'viirs': {
+        'QF1': (Flag('cloud',2,3,(0,1,2)),),
+        'QF2': (Flag('shadow',3,3,(0,)),Flag('snow',5,5,(0,))),
+    },
+    # confidently clear VIIRS pixels used for the locally preprocessed tiles
+    'viirs_clear': {
+        'QF1': (Flag('cloud',2,3,(0,)),),
+        'QF2': (Flag('shadow',3,3,(0,)),),
+    },
+    'modis': {
+        'state_1km': (Flag('cloud',10,10,(0,)),Flag('shadow',2,2,(0,)),Flag('snow',15,15,(0,))),
+    },
+    'landsat': {
+        'pixel_qa': (Flag('cloud',5,5,(0,)),Flag('shadow',3,3,(0,))),
+    },
+    'sentinel2': {
+        'SCL': (Flag('scene',0,7,(4,5,6)),),
+    },
+}
+
+
+def _bits(flag):
+    return (1 << (flag.end - flag.start + 1)) - 1
+
+
+def _layout(layout):
+    if isinstance(layout,dict):
+        # flags are made hashable so their lookup tables can be cached
+        return {band:tuple(Flag(f[0],f[1],f[2],tuple(f[3])) for f in flags)
+                for band,flags in layout.items()}
+    elif layout in LAYOUTS:
+        return LAYOUTS[layout]
+    else:
+        raise ValueError('qa layout must be a dict of flags or one of {}'.format(sorted(LAYOUTS.keys())))
+
+
+@lru_cache(maxsize=None)
+def lookupTable(flags):
+    """Returns a 65536 entry boolean table of whether each possible 16 bit qa
+    word value is clear for all flags. Tables are built once per set of flags.
+
+    Args:
+        flags (tuple): Flag namedtuples of one qa word
+
+    Returns:
+        lut (ndarray): 1-d boolean array indexed by qa word value
+    """
+    words = np.arange(65536,dtype=np.uint32)
+    lut = np.ones(65536,dtype=bool)
+    for flag in flags:
+        value = (words >> flag.start) & _bits(flag)
+        lut &= np.isin(value,flag.clear)
+
+    return lut
+
+
+def decode(words,layout):
+    """Decodes the combined clear sky mask of local qa arrays with one lookup
+    table pass per qa word
+
+    Args:
+        words (dict): {band name: integer ndarray} of the qa words in the layout
+        layout (str | dict): name of a layout in LAYOUTS or a layout dict
+
+    Returns:
+        mask (ndarray): boolean array, True where all flags are clear
+    """
+    mask = None
+    for band,flags in _layout(layout).items():
+        data = np.asarray(words[band])
+        if data.dtype.itemsize == 2:
+            # signed words are reinterpreted so negative fill values index the table
+            data = data.view(np.uint16)
+        elif data.dtype != np.uint8:
+            data = data.astype(np.uint16)
+
+        clear = np.take(lookupTable(flags),data)
+        mask = clear if mask is None else np.logical_and(mask,clear,out=mask)
+
+    return mask
+
+
+def _eeWordMask(word,flags):
+    # flags that must be 0 are merged into a single bitwiseAnd comparison
+    zeros = [f for f in flags if tuple(f.clear) == (0,)]
+    others = [f for f in flags if tuple(f.clear) != (0,)]
+
+    tests = []
+    if zeros:
+        pattern = 0
+        for f in zeros:
+            pattern |= _bits(f) << f.start
+        tests.append(word.bitwiseAnd(pattern).eq(0))
+
+    for f in others:
+        value = word.rightShift(f.start).bitwiseAnd(_bits(f))
+        clear = sorted(f.clear)
+        if clear == list(range(clear[0],clear[-1]+1)):
+            test = value.lte(clear[-1])
+            if clear[0] > 0:
+                test = test.And(value.gte(clear[0]))
+        else:
+            test = value.remap(clear,[1]*len(clear),0)
+        tests.append(test)
+
+    mask = tests[0]
+    for test in tests[1:]:
+        mask = mask.And(test)
+
+    return mask
+
+
+def eeMask(img,layout):
+    """Builds the combined clear sky mask of an ee.Image from its qa bands
+
+    Args:
+        img (ee.Image): image with the qa bands of the layout
+        layout (str | dict): name of a layout in LAYOUTS or a layout dict
+
+    Returns:
+        mask (ee.Image): single band image, 1 where all flags are clear
+    """
+    mask = None
+    for band,flags in _layout(layout).items():
+        wordMask = _eeWordMask(img.select(band),flags)
+        mask = wordMask if mask is None else mask.And(wordMask)
+
+    return ee.Image(mask).rename('qa_mask')
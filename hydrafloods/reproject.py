@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+import os
+import json
+import numpy as np
+from functools import lru_cache
+from pyproj import Transformer
+
+from . import fetch, utils
+
+
+def _outGrid(h,v,window,nPixels,epsg,res,nEdge=64):
+    # output grid covering the window footprint, snapped to multiples of res
+    # so grids of neighbouring tiles line up
+    x0,sres,_,y0,_,_ = fetch.tileGeotransform(h,v,nPixels)
+    xoff,yoff,xsize,ysize = window
+
+    cols = xoff + np.linspace(0,xsize,nEdge)
+    rows = yoff + np.linspace(0,ysize,nEdge)
+    ex = np.concatenate([cols,np.full(nEdge,xoff+xsize),cols[::-1],np.full(nEdge,xoff)])
+    ey = np.concatenate([np.full(nEdge,yoff),rows,np.full(nEdge,yoff+ysize),rows[::-1]])
+
+    toTarget = Transformer.from_crs(fetch.SINUSOIDAL,'EPSG:{}'.format(epsg),always_xy=True)
+    xx,yy = toTarget.transform(x0 + ex*sres, y0 - ey*sres)
+    valid = np.isfinite(xx) & np.isfinite(yy)
+    xx,yy = xx[valid],yy[valid]
+
+    xmin,xmax = np.floor(xx.min()/res)*res, np.ceil(xx.max()/res)*res
+    ymin,ymax = np.floor(yy.min()/res)*res, np.ceil(yy.max()/res)*res
+
+    gt = (float(xmin),float(res),0.,float(ymax),0.,-float(res))
+    shape = (int(round((ymax-ymin)/res)),int(round((xmax-xmin)/res)))
+
+    return gt, shape
+
+
+def _build(path,h,v,window,nPixels,epsg,res,blockRows=256):
+    gt,(rows,cols) = _outGrid(h,v,window,nPixels,epsg,res)
+    x0,sres,_,y0,_,_ = fetch.tileGeotransform(h,v,nPixels)
+    xoff,yoff,xsize,ysize = window
+    fill = xsize*ysize
+
+    toSinusoidal = Transformer.from_crs('EPSG:{}'.format(epsg),fetch.SINUSOIDAL,always_xy=True)
+    xs = gt[0] + (np.arange(cols)+0.5)*gt[1]
+
+    # the map is filled block by block straight into the memory mapped file
+    tmp = '{0}.{1}.part'.format(path,os.getpid())
+    idx = np.lib.format.open_memmap(tmp,mode='w+',dtype=np.int32,shape=(rows,cols))
+    for r in range(0,rows,blockRows):
+        ys = gt[3] + (np.arange(r,min(r+blockRows,rows))+0.5)*gt[5]
+        xx,yy = np.meshgrid(xs,ys)
+        sx,sy = toSinusoidal.transform(xx,yy)
+
+        with np.errstate(invalid='ignore'):
+            c = np.floor((sx - x0)/sres) - xoff
+            rr = np.floor((y0 - sy)/sres) - yoff
+            valid = (c >= 0) & (c < xsize) & (rr >= 0) & (rr < ysize)
+
+        block = np.full(c.shape,fill,dtype=np.int32)
+        block[valid] = (rr[valid]*xsize + c[valid]).astype(np.int32)
+        idx[r:r+block.shape[0]] = block
+
+    idx.flush()
+    del idx
+
+    with open(path[:-4]+'.json','w') as f:
+        json.dump({'gt':gt},f)
+    os.replace(tmp,path)
+
+    return
+
+
+@lru_cache(maxsize=32)
+def _load(path):
+    with open(path[:-4]+'.json') as f:
+        meta = json.load(f)
+
+    return np.load(path,mmap_mode='r'), tuple(meta['gt'])
+
+
+def indexMap(h,v,window=None,epsg=3857,res=500,nPixels=2400,cachedir=None):
+    """Returns the nearest neighbour index map from a sinusoidal tile (or a
+    window of it) to a grid in another projection. Maps are computed once per
+    tile, window, projection and resolution, stored as .npy files and memory
+    mapped, so reprojecting a band is a gather with no coordinate transforms.
+
+    Args:
+        h (int): horizontal tile grid
+        v (int): vertical tile grid
+        window (tuple, optional): (xoff, yoff, xsize, ysize) pixel window of the tile
+        default = None, the whole tile
+        epsg (int, optional): EPSG code of the output projection
+        default = 3857
+        res (float, optional): output resolution in units of the output projection
+        default = 500
+        nPixels (int, optional): number of pixels along a tile side of the input
+        default = 2400
+        cachedir (str, optional): directory of the index maps
+        default = utils.cache_dir('reproject')
+
+    Returns:
+        idx (ndarray): (rows,cols) int32 flat indices into the window, xsize*ysize where there is no data
+        gt (tuple): GDAL geotransform of the output grid
+    """
+    if window is None:
+        window = (0,0,nPixels,nPixels)
+    window = tuple(int(w) for w in window)
+
+    if cachedir is None:
+        cachedir = utils.cache_dir('reproject')
+    name = 'h{0:02d}v{1:02d}_{2}_{3}_{4}_{5}_{6}_{7}_{8}.npy'.format(int(h),int(v),epsg,res,nPixels,*window)
+    path = os.path.join(cachedir,name)
+
+    if os.path.exists(path) != True:
+        _build(path,int(h),int(v),window,nPixels,epsg,res)
+
+    return _load(path)
+
+
+def pad(data,noData):
+    """Returns data flattened with noData appended, the source for gather"""
+    padded = np.empty(data.size+1,dtype=data.dtype)
+    padded[:-1] = data.ravel()
+    padded[-1] = noData
+
+    return padded
+
+
+def gather(padded,idx):
+    """Reprojects a band padded with pad using an index map (or rows of one)"""
+    return np.take(padded,idx)
@@ -3,8 +3,12 @@ import datetime
 import ee
 import os
 import sys
+import hashlib
 import subprocess
+import tempfile
 import numpy as np
+from collections import OrderedDict
+from scipy import ndimage, sparse
 
 
 def find_nearest(xx,yy,xval,yval):
@@ -48,6 +52,271 @@ def geoverts_2_imgverts(poly,yy,xx):
 
     return vertsOut
 
+def _spline_weights(n_in,n_out,order):
+    # sparse (n_out, n_in) matrix of the spline taps ndimage.zoom evaluates
+    # along one axis, output j sits at input j*(n_in-1)/(n_out-1) and taps
+    # beyond the edges are mirrored as zoom does
+    t = np.arange(n_out) * (n_in-1) / float(n_out-1)
+    if order == 1:
+        i0 = np.minimum(np.floor(t).astype(int),n_in-2)
+        x = t - i0
+        idx = [i0,i0+1]
+        w = [1-x,x]
+    else:
+        i0 = np.floor(t).astype(int)
+        x = t - i0
+        idx = [i0-1,i0,i0+1,i0+2]
+        w = [(1-x)**3/6,(3*x**3-6*x**2+4)/6,(-3*x**3+3*x**2+3*x+1)/6,x**3/6]
+
+    period = 2*(n_in-1)
+    cols = []
+    for i in idx:
+        i = np.abs(i) % period
+        cols.append(np.where(i >= n_in,period-i,i))
+    rows = np.tile(np.arange(n_out),len(idx))
+
+    return sparse.csr_matrix((np.concatenate(w),(rows,np.concatenate(cols))),shape=(n_out,n_in))
+
+
+def upsample(data,factor,order=0,out=None,blockRows=512):
+    """
+    Upsample a 2-d array by a factor. Integer factors with nearest neighbour
+    interpolation replicate pixels by assigning a broadcast view of the input
+    into the output in blocks of rows, without the spline machinery and
+    temporary arrays of ndimage.zoom. Linear and cubic splines give the output
+    of ndimage.zoom from one pass along each axis of the spline coefficients,
+    4 taps per pass instead of the 16 zoom evaluates for every output pixel in
+    2-d. Other orders fall back to ndimage.zoom.
+
+    Arguments:
+    -----------
+        data: np.ndarray
+            2-d array to upsample
+        factor: int or float
+            upsampling factor along both axes
+        order: int
+            spline order of the interpolation, 0 for nearest neighbour
+        out: np.ndarray
+            optional preallocated C-contiguous output of shape
+            (rows*factor, cols*factor) that is filled in place
+        blockRows: int
+            number of input rows replicated at a time
+    Returns:
+    -----------
+        out: np.ndarray
+            the upsampled array
+    """
+
+    separable = (order in (1,3)) and (min(data.shape) > 1)
+    if separable and ((out is not None) or (data.dtype.kind == 'f')):
+        shape = (int(round(data.shape[0]*factor)),int(round(data.shape[1]*factor)))
+        if order == 3:
+            coeffs = ndimage.spline_filter(data,order,output=np.float64,mode='mirror')
+        else:
+            coeffs = np.asarray(data,dtype=np.float64)
+
+        rows = _spline_weights(data.shape[0],shape[0],order).dot(coeffs)
+        result = _spline_weights(data.shape[1],shape[1],order).dot(rows.T).T
+        if out is None:
+            return result.astype(data.dtype,copy=False)
+        out[...] = result
+        return out
+
+    if (order != 0) or (int(factor) != factor):
+        # zoom writes into out directly, casting to its dtype
+        return ndimage.zoom(data,factor,order=order,output=out)
+
+    f = int(factor)
+    rows, cols = data.shape
+    if out is None:
+        out = np.empty((rows*f,cols*f),dtype=data.dtype)
+
+    # (rows, f, cols, f) view of the output, each input pixel is broadcast
+    # over its f x f block of output pixels
+    blocks = out.reshape(rows,f,cols,f)
+    for y in range(0,rows,blockRows):
+        blocks[y:y+blockRows] = data[y:y+blockRows,np.newaxis,:,np.newaxis]
+
+    return out
+
+
+def replicate(data,factor):
+    """
+    Return a read-only (rows, factor, cols, factor) strided view of a 2-d
+    array with each pixel repeated factor times along both axes. No data is
+    copied, the view can be used in element-wise operations against an output
+    reshaped the same way.
+    """
+
+    f = int(factor)
+    rows, cols = data.shape
+    return np.broadcast_to(data[:,np.newaxis,:,np.newaxis],(rows,f,cols,f))
+
+
+# widest value range of integer images that is histogrammed with np.bincount
+MAX_BINCOUNT_RANGE = 2**24
+
+
+def _integer_range(data):
+    # (min, max) of integer data histogrammed with np.bincount, None otherwise
+    if (data.dtype.kind not in 'iub') or (data.size == 0):
+        return None
+    lo, hi = int(data.min()), int(data.max())
+    if hi - lo >= MAX_BINCOUNT_RANGE:
+        return None
+
+    return lo, hi
+
+
+def _offsets(data, lo):
+    # non-negative bin indices of integer data starting at lo
+    if lo == 0 and data.dtype.kind in 'ub':
+        return data
+    return np.subtract(data, lo, dtype=np.intp)
+
+
+def _value_counts(data):
+    # sorted unique values of data and their counts, linear time for integers
+    data = data.ravel()
+    bounds = _integer_range(data)
+    if bounds is None:
+        return np.unique(data, return_counts=True)
+
+    counts = np.bincount(_offsets(data, bounds[0]), minlength=bounds[1]-bounds[0]+1)
+    values = np.flatnonzero(counts)
+
+    return values + bounds[0], counts[values]
+
+
+class TemplateCDF(object):
+    """
+    Empirical cumulative distribution function of a template image that
+    source images are histogram matched to. The template is histogrammed
+    once, so one object matches any number of sources, and sources can be
+    matched block by block with matcher. Integer images are histogrammed
+    with np.bincount and matched with a lookup table in linear time, other
+    images fall back to the sort of np.unique.
+
+    Arguments:
+    -----------
+        template: np.ndarray
+            Template image; can have different dimensions to the sources
+    """
+
+    def __init__(self, template):
+        self.values, counts = _value_counts(np.asarray(template))
+        self.quantiles = np.cumsum(counts).astype(np.float64)
+        self.quantiles /= self.quantiles[-1]
+
+    def lookup(self, counts):
+        # template values at the quantiles of a source histogram
+        s_quantiles = np.cumsum(counts).astype(np.float64)
+        s_quantiles /= s_quantiles[-1]
+
+        return np.interp(s_quantiles, self.quantiles, self.values)
+
+    def match(self, source):
+        """
+        Returns source with its histogram matched to the template
+
+        Arguments:
+        -----------
+            source: np.ndarray
+                Image to transform; the histogram is computed over the flattened
+                array
+        Returns:
+        -----------
+            matched: np.ndarray
+                The transformed output image
+        """
+        bounds = _integer_range(source)
+        if bounds is None:
+            s_values, bin_idx, s_counts = np.unique(source.ravel(), return_inverse=True,
+                                                    return_counts=True)
+            return self.lookup(s_counts)[bin_idx].reshape(source.shape)
+
+        # values missing from source get table entries that are never looked up
+        offsets = _offsets(source, bounds[0])
+        counts = np.bincount(offsets.ravel(), minlength=bounds[1]-bounds[0]+1)
+
+        return np.take(self.lookup(counts), offsets)
+
+    def matcher(self, blocks):
+        """
+        Returns a function matching blocks of a source too large to hold at
+        once, with the source histogram accumulated over all of its blocks
+
+        Arguments:
+        -----------
+            blocks: iterable
+                the blocks (np.ndarray) of the source image
+        Returns:
+        -----------
+            match: function
+                maps a block of the source to the matched block
+        """
+        values, counts = None, None
+        for block in blocks:
+            v, c = _value_counts(block)
+            if values is None:
+                values, counts = v, c
+            else:
+                values, idx = np.unique(np.concatenate([values, v]), return_inverse=True)
+                merged = np.zeros(values.size, dtype=np.int64)
+                np.add.at(merged, idx, np.concatenate([counts, c]))
+                counts = merged
+
+        table = self.lookup(counts)
+
+        bounds = _integer_range(values)
+        if bounds is None:
+            return lambda block: table[np.searchsorted(values, block)]
+
+        # dense lookup table over the value range of integer sources
+        dense = np.zeros(bounds[1]-bounds[0]+1)
+        dense[values-bounds[0]] = table
+
+        return lambda block: np.take(dense, _offsets(np.asarray(block), bounds[0]))
+
+
+# template CDFs of the most recently used templates
+_template_cache = OrderedDict()
+
+
+def template_cdf(template, max_items=8):
+    """
+    Returns the TemplateCDF of a template image, cached in memory by a
+    fingerprint of the image so repeated matching to the same template
+    skips its histogram
+
+    Arguments:
+    -----------
+        template: np.ndarray
+            Template image
+        max_items: int
+            number of templates kept in memory
+    Returns:
+    -----------
+        cdf: TemplateCDF
+            cumulative distribution function of the template
+    """
+    template = np.ascontiguousarray(template)
+    sha = hashlib.sha1(template.view(np.uint8).ravel())
+    sha.update(repr((template.dtype.str, template.shape)).encode())
+    key = sha.hexdigest()
+
+    if key in _template_cache:
+        _template_cache.move_to_end(key)
+        return _template_cache[key]
+
+    cdf = TemplateCDF(template)
+    _template_cache[key] = cdf
+    if len(_template_cache) > max_items:
+        _template_cache.popitem(last=False)
+
+    return cdf
+
+
 def hist_match(source, template):
     """
     Adjust the pixel values of a grayscale image such that its histogram
@@ -58,41 +327,81 @@ def hist_match(source, template):
         source: np.ndarray
             Image to transform; the histogram is computed over the flattened
             array
-        template: np.ndarray
-            Template image; can have different dimensions to source
+        template: np.ndarray or TemplateCDF
+            Template image; can have different dimensions to source. A
+            TemplateCDF of a template reused across sources skips its histogram
     Returns:
     -----------
         matched: np.ndarray
             The transformed output image
     """
+    if isinstance(template, TemplateCDF) != True:
+        template = TemplateCDF(template)
 
-    oldshape = source.shape
-    source = source.ravel()
-    template = template.ravel()
-
-    # get the set of unique pixel values and their corresponding indices and
-    # counts
-    s_values, bin_idx, s_counts = np.unique(source, return_inverse=True,
-                                            return_counts=True)
-    t_values, t_counts = np.unique(template, return_counts=True)
+    return template.match(source)
 
-    # take the cumsum of the counts and normalize by the number of pixels to
-    # get the empirical cumulative distribution functions for the source and
-    # template images (maps pixel value --> quantile)
-    s_quantiles = np.cumsum(s_counts).astype(np.float64)
-    s_quantiles /= s_quantiles[-1]
-    t_quantiles = np.cumsum(t_counts).astype(np.float64)
-    t_quantiles /= t_quantiles[-1]
-
-    # interpolate linearly to find the pixel values in the template image
-    # that correspond most closely to the quantiles in the source image
-    interp_t_values = np.interp(s_quantiles, t_quantiles, t_values)
-
-    return interp_t_values[bin_idx].reshape(oldshape)
 
+def _vsimem_chunks(file,chunkSize=1024*1024):
+    # reads an in-memory GDAL file in chunks without copying it to disk
+    from osgeo import gdal
+    f = gdal.VSIFOpenL(file,'rb')
+    if f is None:
+        raise ValueError('file "{0} does not exist'.format(file))
+    try:
+        while True:
+            chunk = gdal.VSIFReadL(1,chunkSize,f)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        gdal.VSIFCloseL(f)
+
+def _push_vsimem(file,bucketPath):
+    name = os.path.basename(file)
+    if bucketPath.startswith('gs://'):
+        # gsutil reads the object from stdin when the source is '-'
+        dest = bucketPath + name if bucketPath.endswith('/') else bucketPath
+        # output goes to a file so a full pipe can not block the writes to stdin
+        with tempfile.TemporaryFile() as log:
+            proc = subprocess.Popen(['gsutil','cp','-',dest], stdin=subprocess.PIPE,
+                                    stdout=log, stderr=subprocess.STDOUT)
+            try:
+                for chunk in _vsimem_chunks(file):
+                    proc.stdin.write(chunk)
+            except BrokenPipeError:
+                # gsutil exited early, its return code and output say why
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+            proc.wait()
+
+            if proc.returncode != 0:
+                log.seek(0)
+                # the /vsimem file is the only copy of the raster, it is kept
+                raise RuntimeError('upload of {0} to {1} failed: {2}'.format(
+                    file,dest,log.read().decode(errors='replace').strip()[-2000:]))
+    else:
+        # local directory as a stand-in sink, e.g. for testing without gcs
+        os.makedirs(bucketPath,exist_ok=True)
+        with open(os.path.join(bucketPath,name),'wb') as dst:
+            for chunk in _vsimem_chunks(file):
+                dst.write(chunk)
+
+    from osgeo import gdal
+    gdal.Unlink(file)
+    return
 
 def push_to_gcs(file,bucketPath):
-    if os.path.exists(file):
+    """Copies a file to a gcs bucket path with gsutil. In-memory /vsimem files
+    are streamed to gsutil (or to a local directory stand-in when bucketPath is
+    not a gs:// path) without touching disk and are freed once uploaded.
+    """
+    if file.startswith('/vsimem/'):
+        _push_vsimem(file,bucketPath)
+    elif os.path.exists(file):
         cmd = "gsutil cp {0} {1}".format(file,bucketPath)
         proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         out, err = proc.communicate()
@@ -167,3 +476,103 @@ def parse_atms_time(infile):
 def parse_viirs_time(infile):
 
     return
+
+def cache_dir(*subdirs):
+    """Returns (and creates) a directory for hydrafloods on-disk caches. The
+    root can be set with the HYDRAFLOODS_CACHE environment variable and
+    defaults to ~/.cache/hydrafloods
+    """
+    root = os.environ.get('HYDRAFLOODS_CACHE',
+                          os.path.join(os.path.expanduser('~'),'.cache','hydrafloods'))
+    path = os.path.join(root,*subdirs)
+    os.makedirs(path,exist_ok=True)
+
+    return path
+
+def _limit_memory(maxBytes):
+    # worker initializer, allocations beyond the limit raise MemoryError in the worker
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS,(maxBytes,maxBytes))
+    return
+
+def pool_map(func,items,workers=None,max_memory=None):
+    """Applies a function to items on a pool of worker processes, returning the
+    results in the order of the items. A failing item is reported and returns
+    None instead of stopping the batch. Items lost when a worker died are retried
+    on a new pool, those lost again in halves until a process is left with the
+    item that kills it, so a single bad file can only fail itself.
+
+    Arguments:
+    -----------
+    func : callable
+        picklable function applied to each item, e.g. a functools.partial of a module level function
+    items : list
+        inputs of func
+    workers : int, optional
+        number of worker processes, default is the number of cpus
+    max_memory : float, optional
+        address space limit of each worker in GB, default is no limit
+
+    Returns:
+    -----------
+    results : list
+        output of func for each item, None for items that failed
+    """
+    from concurrent import futures
+    from concurrent.futures.process import BrokenProcessPool
+
+    items = list(items)
+    workers = workers if workers else os.cpu_count()
+    kwargs = {}
+    if max_memory:
+        kwargs = {'initializer':_limit_memory,'initargs':(int(max_memory*1024**3),)}
+
+    def _report(item,e):
+        print('processing of {0} failed: {1}'.format(item,e))
+        return
+
+    results = [None] * len(items)
+
+    def _run(indices,nWorkers):
+        # runs the items on one pool, returning those lost to a worker that died
+        broken = []
+        with futures.ProcessPoolExecutor(max_workers=min(nWorkers,max(len(indices),1)),**kwargs) as pool:
+            jobs = {}
+            for n,i in enumerate(indices):
+                try:
+                    jobs[pool.submit(func,items[i])] = i
+                except BrokenProcessPool:
+                    # the pool broke while still submitting
+                    broken += list(indices[n:])
+                    break
+
+            for job in futures.as_completed(jobs):
+                i = jobs[job]
+                try:
+                    results[i] = job.result()
+                except BrokenProcessPool:
+                    broken.append(i)
+                except Exception as e:
+                    _report(items[i],e)
+
+        return sorted(broken)
+
+    # a worker that died took every unfinished job of the pool with it, those
+    # are rerun on a new pool. Items lost again are split in halves that each
+    # get a new pool until the one killing its worker is left alone
+    pending = [_run(range(len(items)),workers)]
+    while pending:
+        group = pending.pop()
+        if len(group) == 0:
+            continue
+
+        broken = _run(group,workers if len(group) > 1 else 1)
+        if len(group) == 1 and broken:
+            _report(items[group[0]],'the worker process died')
+        elif len(broken) > 1:
+            half = len(broken) // 2
+            pending += [broken[half:],broken[:half]]
+        elif broken:
+            pending.append(broken)
+
+    return results
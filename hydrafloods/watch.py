@@ -0,0 +1,152 @@
+from __future__ import absolute_import
+import os
+import time
+import datetime
+import threading
+import requests
+from concurrent import futures
+
+from . import fetch, listing
+
+
+def _nrtUrl(sensor,product):
+    if sensor == 'viirs':
+        return fetch.VIIRS_NRT.format(product+'_NRT'), product+'_NRT'
+    elif sensor == 'modis':
+        return fetch.MODIS_NRT.format(product), product
+    else:
+        raise ValueError('sensor keyword must be either viirs or modis')
+
+
+class Watcher(object):
+    """Polls the VIIRS/MODIS NRT archive for new granules of a set of tiles and
+    hands them to a callback as soon as they are downloaded. The archive
+    listing is revalidated with conditional requests so an unchanged directory
+    costs a 304 response, and the polling interval backs off while nothing new
+    arrives or the archive is unreachable. Granules handled without error are
+    recorded in a file in workdir so a restarted watcher skips them.
+
+    Args:
+        sensor (str): either 'viirs' or 'modis'
+        product (str): product short name, e.g. VNP09GA or MOD09GA
+        tiles (list): (h,v) tuples to watch, e.g. the output of fetch.findTiles
+        workdir (str, optional): root directory, granules are written to workdir/YYYYMMDD/sensor
+        default = './'
+        creds (str, optional): path to .netrc file with NASA EarthData login in credentials
+        default = None
+        callback (callable, optional): function called with (file, date, h, v) for each new granule
+        default = None
+        interval (int, optional): seconds between polls when new data is arriving
+        default = 300
+        maxInterval (int, optional): upper limit in seconds of the backed off interval
+        default = 3600
+        days (int, optional): number of days back from today to look for granules
+        default = 1
+        workers (int, optional): number of granules downloaded and processed concurrently
+        default = 4
+        granuleCache (cache.GranuleCache, optional): shared granule store
+        default = None
+    """
+    def __init__(self,sensor,product,tiles,workdir='./',creds=None,callback=None,
+                 interval=300,maxInterval=3600,days=1,workers=4,granuleCache=None):
+        self.sensor = sensor
+        self.product = product
+        self.tiles = [(int(h),int(v)) for h,v in tiles]
+        self.workdir = workdir
+        self.creds = creds
+        self.callback = callback
+        self.interval = interval
+        self.maxInterval = maxInterval
+        self.days = days
+        self.workers = workers
+        self.granuleCache = granuleCache
+
+        self.url, self.prefix = _nrtUrl(sensor,product)
+        self.index = listing.ListingIndex(ttl=0)
+        self.seen = set()
+        self.doneFile = os.path.join(workdir,'{0}_watched.txt'.format(self.prefix))
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.doneFile):
+            with open(self.doneFile) as f:
+                self.seen.update(line.strip() for line in f if line.strip())
+
+        return
+
+    def _dates(self):
+        today = datetime.datetime.now()
+        today = datetime.datetime(today.year,today.month,today.day)
+        return [today - datetime.timedelta(i) for i in range(self.days)]
+
+    def poll(self,s):
+        """Returns the (url, outFile, date, h, v) of granules for the watched
+        tiles that appeared in the archive since the last poll"""
+        entry = self.index.entry(s,self.url,refresh=True)
+
+        new = []
+        for date in self._dates():
+            outdir = os.path.join(self.workdir,date.strftime('%Y%m%d'),self.sensor)
+            for h,v in self.tiles:
+                f = entry['granules'].get(listing.granuleKey(self.prefix,date,h,v))
+                if (f is None) or (f in self.seen):
+                    continue
+                self.seen.add(f)
+                new.append((self.url+f,os.path.join(outdir,f),date,h,v))
+
+        return new
+
+    def _handle(self,s,target):
+        url,outFile,date,h,v = target
+        os.makedirs(os.path.dirname(outFile),exist_ok=True)
+
+        try:
+            fetch._cachedDownload(s,url,outFile,self.granuleCache)
+            if self.callback is not None:
+                self.callback(outFile,date,h,v)
+            self._done(os.path.basename(outFile))
+        except Exception as e:
+            # forget the granule so it is picked up again on the next poll
+            self.seen.discard(os.path.basename(outFile))
+            print('processing of {0} failed: {1}'.format(os.path.basename(outFile),e))
+
+        return
+
+    def _done(self,name):
+        # granules in flight are only kept in seen, finished ones survive a restart
+        with self._lock:
+            with open(self.doneFile,'a') as f:
+                f.write(name + '\n')
+
+        return
+
+    def run(self,iterations=None):
+        """Polls the archive until interrupted or for a number of iterations
+
+        Args:
+            iterations (int, optional): number of polls before returning
+            default = None, poll forever
+        """
+        interval = self.interval
+        n = 0
+
+        with fetch._session(self.creds,self.workers) as s,\
+             futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while (iterations is None) or (n < iterations):
+                n += 1
+                try:
+                    new = self.poll(s)
+                except requests.RequestException as e:
+                    print('polling {0} failed: {1}'.format(self.url,e))
+                    new = None
+
+                if new:
+                    for target in new:
+                        pool.submit(self._handle,s,target)
+                    interval = self.interval
+                else:
+                    interval = min(interval*2,self.maxInterval)
+
+                if (iterations is None) or (n < iterations):
+                    time.sleep(interval)
+
+        return